@@ -0,0 +1,108 @@
+"""
+Microbenchmark of contraction signs: the position-based signs produced
+by wick.wick.contractions against the previous path, which looked up
+positions with operators.index and counted crossings with find_pair.
+
+Usage: PYTHONPATH=. python benchmarks/bench_sign.py
+"""
+import random
+import timeit
+from wick.index import Idx
+from wick.operator import FOperator
+from wick.wick import valid_contraction, contractions, ContractionCache
+
+
+def _old_pair_list(lst):
+    if len(lst) == 2:
+        if valid_contraction(lst[0], lst[1]):
+            return [[(lst[0], lst[1])]]
+        return []
+    plist = []
+    for i, x in enumerate(lst[1:]):
+        if valid_contraction(lst[0], x):
+            remainder = _old_pair_list(lst[1:i + 1] + lst[i + 2:])
+            plist += [r + [(lst[0], x)] for r in remainder]
+    return plist
+
+
+def _old_find_pair(i, ipairs):
+    for p in ipairs:
+        if i in p:
+            return p
+    return None
+
+
+def _old_get_sign(ipairs):
+    ncross = 0
+    for i, j in ipairs:
+        for x1 in range(i + 1, j):
+            p1 = _old_find_pair(x1, ipairs)
+            if p1 is None:
+                continue
+            x2 = p1[0] if p1[1] == x1 else p1[1]
+            if x2 > j or x2 < i:
+                ncross += 1
+    ncross = ncross // 2
+    return 1 if ncross % 2 == 0 else -1
+
+
+def old_signs(operators):
+    signs = []
+    for pairs in _old_pair_list(operators):
+        ipairs = [(operators.index(oi), operators.index(oj))
+                  for oi, oj in pairs]
+        signs.append(_old_get_sign(ipairs))
+    return signs
+
+
+def new_signs(operators):
+    # no template cache, so that every call enumerates the pairings
+    cache = ContractionCache(maxsize=0)
+    return [s for _, s in contractions(operators, cache=cache)]
+
+
+def random_string(n, rng):
+    """Return a fermion operator string of length n with a contraction"""
+    slots = list(range(n))
+    rng.shuffle(slots)
+    operators = [None]*n
+    for k in range(n // 2):
+        i, j = sorted(slots[2*k:2*k + 2])
+        space = rng.choice(["occ", "vir"])
+        occ = space == "occ"
+        operators[i] = FOperator(Idx(i, space), occ)
+        operators[j] = FOperator(Idx(j, space), not occ)
+    return operators
+
+
+def main():
+    rng = random.Random(7)
+    print("  n  pairings     old (us)     new (us)   speedup")
+    for n in range(4, 18, 2):
+        cases = [random_string(n, rng) for _ in range(20)]
+        npairs = 0
+        for ops in cases:
+            signs = new_signs(ops)
+            assert signs == old_signs(ops)
+            npairs += len(signs)
+
+        def old():
+            for ops in cases:
+                old_signs(ops)
+
+        def new():
+            for ops in cases:
+                new_signs(ops)
+
+        nrep = max(1, 2000 // (npairs + 1))
+        told = min(timeit.repeat(old, number=nrep, repeat=3))
+        tnew = min(timeit.repeat(new, number=nrep, repeat=3))
+        # time per pairing in microseconds
+        told *= 1e6/(nrep*max(npairs, 1))
+        tnew *= 1e6/(nrep*max(npairs, 1))
+        print("{:3d} {:9d} {:12.2f} {:12.2f} {:8.1f}x".format(
+            n, npairs, told, tnew, told/tnew))
+
+
+if __name__ == "__main__":
+    main()
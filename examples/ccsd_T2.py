@@ -1,11 +1,11 @@
 from fractions import Fraction
-from wick.expression import AExpression
+from wick.expression import AExpression, LazyExpression
 from wick.wick import apply_wick
 from wick.convenience import one_e, two_e, E1, E2, braE2, commute
 
 H1 = one_e("f", ["occ", "vir"], norder=True)
 H2 = two_e("I", ["occ", "vir"], norder=True, compress=True)
-H = H1 + H2
+H = LazyExpression(H1 + H2)
 
 bra = braE2("occ", "vir", "occ", "vir")
 T1 = E1("t", ["occ"], ["vir"])
@@ -4,7 +4,7 @@ from fractions import Fraction
 from .index import Idx
 from .operator import Projector, BOperator, FOperator
 from .operator import TensorSym, Tensor, Sigma, normal_ordered
-from .expression import Term, Expression
+from .expression import Term, Expression, LazyExpression
 
 
 def one_e(name, spaces, norder=False, index_key=None):
@@ -177,13 +177,11 @@ def two_p(name, space="nm", index_key=None):
 
 def _get_tc(x, p1, p2, name2, norder, index_key):
     sigmas = [Sigma(x), Sigma(p1), Sigma(p2)]
+    operators = [
+        BOperator(x, True), FOperator(p1, True), FOperator(p2, False)]
+    nsign = 1
     if norder:
-        operators, nsign = normal_ordered(
-            [FOperator(p1, True), FOperator(p2, False)])
-    else:
-        nsign = 1
-        operators = [FOperator(p1, True), FOperator(p2, False)]
-    operators = [BOperator(x, True)] + operators
+        operators, nsign = normal_ordered(operators)
     tensors = [Tensor([x, p1, p2], name2)]
     tc = Term(nsign, sigmas, tensors, operators, [], index_key=index_key)
     return tc
@@ -191,13 +189,11 @@ def _get_tc(x, p1, p2, name2, norder, index_key):
 
 def _get_ta(x, p1, p2, name, norder, index_key):
     sigmas = [Sigma(x), Sigma(p1), Sigma(p2)]
+    operators = [
+        BOperator(x, False), FOperator(p1, True), FOperator(p2, False)]
+    nsign = 1
     if norder:
-        operators, nsign = normal_ordered(
-            [FOperator(p1, True), FOperator(p2, False)])
-    else:
-        nsign = 1
-        operators = [FOperator(p1, True), FOperator(p2, False)]
-    operators = [BOperator(x, False)] + operators
+        operators, nsign = normal_ordered(operators)
     tensors = [Tensor([x, p1, p2], name)]
     ta = Term(nsign, sigmas, tensors, operators, [], index_key=index_key)
     return ta
@@ -966,6 +962,16 @@ def PE1(ospace, vspace, index_key=None):
     return exp
 
 
-def commute(A, B):
-    """ Return the commutator of two operators"""
+def commute(A, B, occ=None):
+    """
+    Return the commutator of two operators
+
+    Nested commutators of a LazyExpression with the same commuting
+    expression (see Expression.commuting) are expanded by
+    LazyExpression.commute. occ gives the occupied spaces used to
+    decide whether B commutes and must match the occ used to contract
+    the result.
+    """
+    if isinstance(A, LazyExpression):
+        return A.commute(B, occ=occ)
     return A*B - B*A
@@ -1,9 +1,10 @@
 # Copyright (c) 2020-2021 Alec White
 # Licensed under the MIT License (see LICENSE for details)
 from copy import copy
-from itertools import product
+from itertools import combinations_with_replacement, product
+from math import factorial
 from numbers import Number
-from .operator import Sigma, Tensor, permute, tensor_from_delta
+from .operator import Tensor, Delta, permute, tensor_from_delta
 
 
 class TermMap(object):
@@ -44,154 +45,150 @@ class TermMap(object):
         else:
             return NotImplemented
 
+    def key(self):
+        """Return the contraction pattern as a sorted tuple"""
+        return tuple(sorted(
+            (name, tuple((space, tuple(sorted(x))) for space, x in lll))
+            for name, lll in self.data))
+
+
+_groups = {}
+
+
+def _is_group(sym):
+    # check that the permutations of a TensorSym are closed under
+    # composition with consistent signs
+    tlist = [(tuple(p), sp) for p, sp in sym.tlist]
+    key = tuple(tlist)
+    if key not in _groups:
+        signs = dict(tlist)
+        closed = len(signs) == len(tlist)
+        for p, sp in tlist:
+            for q, sq in tlist:
+                pq = tuple(p[i] for i in q)
+                if signs.get(pq) != sp*sq:
+                    closed = False
+        _groups[key] = closed
+    return _groups[key]
+
+
+def _relabeled(other, info1, info2, cache=None):
+    # Return the right-hand factor of a product, with its indices shifted
+    # past those of the left-hand factor if the two share any index. The
+    # shifted terms are kept in cache by shift so that they are only
+    # built once for all left-hand terms with the same largest index.
+    s1, m1 = info1
+    s2, _ = info2
+    if s1.isdisjoint(s2):
+        return other
+    if cache is None:
+        return other._inc(m1 + 1)
+    new = cache.get(m1)
+    if new is None:
+        new = cache[m1] = other._inc(m1 + 1)
+    return new
+
+
+def _products(left, right, pairs=None):
+    # products of the terms of two lists, over all pairs of positions in
+    # order or over the given (i, j) pairs
+    linfo = [t._index_info() for t in left]
+    rinfo = [t._index_info() for t in right]
+    caches = [{} for t in right]
+    if pairs is None:
+        pairs = product(range(len(left)), range(len(right)))
+    return [
+        left[i]._join(_relabeled(right[j], linfo[i], rinfo[j], caches[j]))
+        for i, j in pairs]
+
+
+def _add_ranks(*ranks):
+    total = {}
+    for r in ranks:
+        if r is None:
+            return None
+        for k, n in r:
+            total[k] = total.get(k, 0) + n
+    return tuple(sorted((k, n) for k, n in total.items() if n != 0))
 
-default_index_key = {"occ": "ijklmnop", "vir": "abcdefgh", "nm": "IJKLMNOP"}
 
+def _neg_rank(r):
+    return None if r is None else tuple((k, -n) for k, n in r)
 
-def _resolve(sums, tensors, operators, deltas):
-    newdel = [d.copy() for d in deltas]
-    newsums = [s.copy() for s in sums]
-    newtens = [t.copy() for t in tensors]
-    newops = [o.copy() for o in operators]
-
-    # get unique deltas
-    newdel = list(set(newdel))
-
-    # Cases:
-    #   0 sums over neither index
-    #   1 sums over 1st index
-    #   2 sums over 2nd index
-    #   3 sums over both indices
-    def get_case(dd):
-        i2 = dd.i2
-        i1 = dd.i1
-        assert i1.space == i2.space
-
-        #islist = set([s.idx for s in sums])
-        islist = {s.idx for s in sums}
-        is1 = i1 in islist
-        is2 = i2 in islist
-        case = 0
-        if is1:
-            case = 1
-        if is2:
-            case = (2 if case == 0 else 3)
-        return case
-
-    cases = [get_case(dd) for dd in newdel]
-
-    rs = []
-    # loop over deltas for case 1 and 2
-    for dd, case in zip(newdel, cases):
-        i2 = dd.i2
-        i1 = dd.i1
-
-        if case == 3:
-            continue
-        if case == 1:
-            dindx = newsums.index(Sigma(i1))
-            del newsums[dindx]
-        elif case == 2:
-            dindx = newsums.index(Sigma(i2))
-            del newsums[dindx]
-        else:
-            assert case == 0
-
-        for i, (ddd, ccc) in enumerate(zip(newdel, cases)):
-            if case == 1 and ddd.i1 == i1:
-                newdel[i].i1 = i2
-                if ccc == 3:
-                    cases[i] = 2
-                elif ccc == 1:
-                    cases[i] = 0
-                else:
-                    assert False
-            elif case == 1 and ddd.i2 == i1:
-                newdel[i].i2 = i2
-                if ccc == 3:
-                    cases[i] = 1
-                elif ccc == 2:
-                    cases[i] = 0
-                else:
-                    assert False
-            elif case == 2 and ddd.i2 == i2:
-                newdel[i].i2 = i1
-                if ccc == 3:
-                    cases[i] = 1
-                elif ccc == 2:
-                    cases[i] = 0
-                else:
-                    assert False
-            elif case == 2 and ddd.i1 == i2:
-                newdel[i].i1 = i1
-                if ccc == 3:
-                    cases[i] = 2
-                elif ccc == 1:
-                    cases[i] = 0
-                else:
-                    assert False
-
-        for tt in newtens:
-            for k, _ in enumerate(tt.indices):
-                if case == 1:
-                    if tt.indices[k] == i1:
-                        tt.indices[k] = i2
-                elif case == 2:
-                    if tt.indices[k] == i2:
-                        tt.indices[k] = i1
-
-        for oo in newops:
-            if case == 1:
-                if oo.idx == i1:
-                    oo.idx = i2
-            elif case == 2:
-                if oo.idx == i2:
-                    oo.idx = i1
-
-        if not (case == 0 and i1 != i2):
-            rs.append(dd)
-
-    for d in rs:
-        dindx = newdel.index(d)
-        del newdel[dindx]
-        del cases[dindx]
-
-    # recur if deltas of type 1 or 2 remain
-    if 1 in cases or 2 in cases:
-        return _resolve(newsums, newtens, newops, newdel)
-
-    # loop over case 3 deltas
-    rs = []
-    for dd, case in zip(newdel, cases):
-        i2 = dd.i2
-        i1 = dd.i1
-
-        if case == 3:
-            dindx = newsums.index(Sigma(i2))
-            del newsums[dindx]
-        elif case < 3:
-            assert case == 0
-        else:
-            assert False
 
-        if case == 0:
-            continue
+def _letters(idx, index_key):
+    # letters of the index space from index_key or the space registry
+    if idx.space in index_key:
+        return index_key[idx.space]
+    if idx.ispace.letters is None:
+        raise KeyError(idx.space)
+    return idx.ispace.letters
 
-        for tt in newtens:
-            for k, _ in enumerate(tt.indices):
-                if tt.indices[k] == i2:
-                    tt.indices[k] = i1
 
-        for oo in newops:
-            if oo.idx == i2:
-                oo.idx = i1
+def _find_idx(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
 
-        rs.append(dd)
 
-    for d in rs:
-        dindx = newdel.index(d)
-        del newdel[dindx]
-    return newsums, newtens, newops, newdel
+def _resolve(sums, tensors, operators, deltas):
+    # The deltas join the indices into equivalence classes. Every summed
+    # index of a class is replaced by the representative of the class,
+    # which is the first external index of the class if there is one and
+    # the first index otherwise, and its sum is removed. Deltas are only
+    # kept between the different external indices of a class.
+    newdel = []
+    for d in deltas:
+        assert d.i1.space == d.i2.space
+        if d not in newdel:
+            newdel.append(d)
+    summed = {s.idx for s in sums}
+
+    parent = {}
+    order = []
+    for d in newdel:
+        for i in (d.i1, d.i2):
+            if i not in parent:
+                parent[i] = i
+                order.append(i)
+        r1 = _find_idx(parent, d.i1)
+        r2 = _find_idx(parent, d.i2)
+        if r1 != r2:
+            parent[r2] = r1
+
+    rep = {}
+    for i in order:
+        r = _find_idx(parent, i)
+        if r not in rep or (rep[r] in summed and i not in summed):
+            rep[r] = i
+    imap = {}
+    for i in order:
+        x = rep[_find_idx(parent, i)]
+        if i in summed and i != x:
+            imap[i] = x
+
+    newsums = [s for s in sums if s.idx not in imap]
+    newtens = [
+        Tensor([imap.get(i, i) for i in t.indices], t.name, sym=t.sym)
+        for t in tensors]
+    newops = [
+        type(o)(imap[o.idx], o.ca) if o.idx in imap else o
+        for o in operators]
+
+    # join the external indices with a spanning set of deltas
+    eparent = {}
+    dnew = []
+    for d in newdel:
+        i1 = imap.get(d.i1, d.i1)
+        i2 = imap.get(d.i2, d.i2)
+        r1 = _find_idx(eparent, eparent.setdefault(i1, i1))
+        r2 = _find_idx(eparent, eparent.setdefault(i2, i2))
+        if r1 == r2:
+            continue
+        eparent[r2] = r1
+        dnew.append(Delta(i1, i2))
+    return newsums, newtens, newops, dnew
 
 
 class Term(object):
@@ -204,6 +201,9 @@ class Term(object):
         operators (list): list of creation/anihillation operators
         deltas (list): list of delta functions
     """
+    __slots__ = (
+        "scalar", "sums", "tensors", "operators", "deltas", "index_key")
+
     def __init__(self, scalar, sums, tensors, operators, deltas, index_key=None):
         self.scalar = scalar
         self.sums = sums
@@ -238,24 +238,33 @@ class Term(object):
             new.scalar *= other
             return new
         elif isinstance(other, Term):
-            sil1 = set(self.ilist())
-            sil2 = set(other.ilist())
-            if sil1.intersection(sil2):
-                m = max([i.index for i in sil1])
-                new = other._inc(m + 1)
-            else:
-                new = other
-            scalar = self.scalar*new.scalar
-            sums = self.sums + new.sums
-            tensors = self.tensors + new.tensors
-            operators = self.operators + new.operators
-            deltas = self.deltas + new.deltas
-            index_key = other.index_key if self.index_key is None else self.index_key
-            return Term(
-                scalar, sums, tensors, operators, deltas, index_key=index_key)
+            new = _relabeled(other, self._index_info(), other._index_info())
+            return self._join(new)
         else:
             return NotImplemented
 
+    def _join(self, new):
+        # product with a term whose indices do not clash
+        scalar = self.scalar*new.scalar
+        sums = self.sums + new.sums
+        tensors = self.tensors + new.tensors
+        operators = self.operators + new.operators
+        deltas = self.deltas + new.deltas
+        index_key = new.index_key if self.index_key is None else self.index_key
+        return Term(
+            scalar, sums, tensors, operators, deltas, index_key=index_key)
+
+    def _index_info(self):
+        # set of indices and the largest index number
+        s = {o.idx for o in self.operators if o.idx is not None}
+        for t in self.tensors:
+            s.update(t.indices)
+        s.update(x.idx for x in self.sums)
+        for d in self.deltas:
+            s.add(d.i1)
+            s.add(d.i2)
+        return s, max((i.index for i in s), default=-1)
+
     def __rmul__(self, other):
         if isinstance(other, Number):
             new = self.copy()
@@ -287,10 +296,7 @@ class Term(object):
             deltas, index_key=self.index_key)
 
     def _idx_map(self):
-        if self.index_key is None:
-            index_key = default_index_key
-        else:
-            index_key = self.index_key
+        index_key = {} if self.index_key is None else self.index_key
         ilist = self.ilist()
         off = {}
         imap = {}
@@ -302,7 +308,7 @@ class Term(object):
             else:
                 o = 0
                 off[s] = 1
-            imap[idx] = index_key[s][o]
+            imap[idx] = _letters(idx, index_key)[o]
         return imap
 
     def _print_str(self, with_scalar=True):
@@ -335,6 +341,23 @@ class Term(object):
         ret.sort()
         return ret
 
+    def excitation_rank(self, occ=None):
+        """
+        Return the net number of quasi-particle creation operators of
+        each (space, fermion) pair as a sorted tuple of non-zero
+        ((space, fermion), n) items. The operators can only be fully
+        contracted if the rank is empty. Return None if the term contains
+        projectors.
+        """
+        rank = {}
+        for op in self.operators:
+            if op.idx is None:
+                return None
+            key = (op.idx.space, op.idx.fermion)
+            n = 1 if op.qp_creation(occ=occ) else -1
+            rank[key] = rank.get(key, 0) + n
+        return tuple(sorted((k, n) for k, n in rank.items() if n != 0))
+
     def copy(self):
         newscalar = copy(self.scalar)
         newsums = [s.copy() for s in self.sums]
@@ -354,6 +377,8 @@ class ATerm(object):
         sums (list): list of Sums in the term
         tensors (list): list of Tensors
     """
+    __slots__ = ("scalar", "sums", "tensors", "index_key")
+
     def __init__(self, scalar=None, sums=None,
                  tensors=None, index_key=None, term=None):
         if term is not None:
@@ -396,22 +421,27 @@ class ATerm(object):
             new.scalar *= other
             return new
         elif isinstance(other, ATerm):
-            sil1 = set(self.ilist())
-            sil2 = set(other.ilist())
-            if sil1.intersection(sil2):
-                m = max([i.index for i in sil1])
-                new = other._inc(m + 1)
-            else:
-                new = other
-            scalar = self.scalar*new.scalar
-            sums = self.sums + new.sums
-            tensors = self.tensors + new.tensors
-            return ATerm(
-                scalar=scalar, sums=sums,
-                tensors=tensors, index_key=self.index_key)
+            new = _relabeled(other, self._index_info(), other._index_info())
+            return self._join(new)
         else:
             return NotImplemented
 
+    def _join(self, new):
+        # product with a term whose indices do not clash
+        scalar = self.scalar*new.scalar
+        sums = self.sums + new.sums
+        tensors = self.tensors + new.tensors
+        return ATerm(
+            scalar=scalar, sums=sums,
+            tensors=tensors, index_key=self.index_key)
+
+    def _index_info(self):
+        # set of indices and the largest index number
+        s = {x.idx for x in self.sums}
+        for t in self.tensors:
+            s.update(t.indices)
+        return s, max((i.index for i in s), default=-1)
+
     def __rmul__(self, other):
         if isinstance(other, Number):
             new = self.copy()
@@ -465,10 +495,7 @@ class ATerm(object):
             tensors=tensors, index_key=self.index_key)
 
     def _idx_map(self):
-        if self.index_key is None:
-            index_key = default_index_key
-        else:
-            index_key = self.index_key
+        index_key = {} if self.index_key is None else self.index_key
         ilist = self.ilist()
         off = {}
         imap = {}
@@ -480,7 +507,7 @@ class ATerm(object):
             else:
                 o = 0
                 off[s] = 1
-            imap[idx] = index_key[s][o]
+            imap[idx] = _letters(idx, index_key)[o]
         return imap
 
     def _print_str(self, with_scalar=True):
@@ -537,6 +564,30 @@ class ATerm(object):
         else:
             return NotImplemented
 
+    def diagram(self):
+        """
+        Return a key for the contraction pattern of the term and the sign
+        of the tensor permutation that brings the term to it.
+
+        Terms that pmatch each other have the same key. The sign is None
+        if the pattern is reached with both signs.
+        """
+        tlists = [t.sym.tlist for t in self.tensors]
+        best = None
+        sign = None
+        for xs in product(*tlists):
+            s = 1
+            for x in xs:
+                s *= x[1]
+            newtensors = [permute(t, x[0]) for t, x in zip(self.tensors, xs)]
+            k = TermMap(self.sums, newtensors).key()
+            if best is None or k < best:
+                best = k
+                sign = s
+            elif k == best and s != sign:
+                sign = None
+        return (len(self.tensors), len(self.sums), best), sign
+
     def ilist(self):
         ilist = []
         for tt in self.tensors:
@@ -692,15 +743,56 @@ class Expression(object):
             return NotImplemented
 
     def __mul__(self, other):
+        return self.multiply(other)
+
+    def multiply(self, other, vacuum=False, occ=None):
+        """
+        Return the product of this expression and a number or expression.
+
+        other (Expression): Right-hand factor
+        vacuum (bool): Only keep products whose net excitation rank is
+            zero, i.e. the products that can have a vacuum expectation
+            value. Use this for the outermost product (e.g. bra*Hbar).
+        occ (list): Names of the occupied spaces
+        """
         if isinstance(other, Number):
             new = Expression([other*t for t in self.terms])
             return new
         elif isinstance(other, Expression):
-            terms = [t1*t2 for t1, t2 in product(self.terms, other.terms)]
-            return Expression(terms)
+            if not vacuum:
+                return Expression(_products(self.terms, other.terms))
+
+            # group the right-hand terms by rank in their original order
+            ranked = {}
+            unranked = []
+            for i, t2 in enumerate(other.terms):
+                r = t2.excitation_rank(occ=occ)
+                if r is None:
+                    unranked.append(i)
+                else:
+                    ranked.setdefault(r, []).append(i)
+            pairs = []
+            for i, t1 in enumerate(self.terms):
+                r = t1.excitation_rank(occ=occ)
+                if r is None:
+                    idx = range(len(other.terms))
+                else:
+                    idx = sorted(ranked.get(_neg_rank(r), []) + unranked)
+                pairs += [(i, j) for j in idx]
+            return Expression(_products(self.terms, other.terms, pairs))
         else:
             return NotImplemented
 
+    def prune_rank(self, occ=None):
+        """
+        Remove the terms whose net excitation rank is not zero. These
+        terms have no fully contracted part. Terms with projectors are
+        kept.
+        """
+        self.terms = [
+            t for t in self.terms
+            if t.excitation_rank(occ=occ) in (None, ())]
+
     def __eq__(self, other):
         if isinstance(other, Expression):
             # NOTE: This compares in fixed order with fixed indices
@@ -733,6 +825,337 @@ class Expression(object):
                 return True
         return False
 
+    def commuting(self, occ=None):
+        """
+        Return True if the terms commute with each other. This is the
+        case if all operators are quasi-particle creators (e.g. cluster
+        operators), or all are quasi-particle annihilators, and every
+        term has an even number of Fermion operators.
+
+        occ (list): Names of the occupied spaces
+        """
+        kinds = set()
+        for t in self.terms:
+            nf = 0
+            for op in t.operators:
+                if op.idx is None:
+                    return False
+                kinds.add(op.qp_creation(occ=occ))
+                nf += op.idx.fermion
+            if nf % 2 != 0 or len(kinds) > 1:
+                return False
+        return True
+
+
+class LazyExpression(object):
+    """Unexpanded operator expression
+
+    Sums, differences, products and multiples of lazy expressions (and
+    commutators built from them) are stored as a tree and only expanded
+    into terms when the expression is iterated. When only the terms of
+    a given excitation rank are needed (e.g. the terms that can have a
+    vacuum expectation value), the rank is propagated down the tree so
+    that products whose rank cannot reach it are never formed. The
+    terms are produced in the same order as in the product of the
+    expanded Expressions, except for commutators with commuting
+    expressions (see commute).
+
+    Attributes:
+        terms (list): List of terms of a leaf expression
+    """
+    def __init__(self, e):
+        self.terms = list(e.terms)
+        self._rank_lists = {}
+        self._rank_sets = {}
+
+    def _ranks(self, occ):
+        key = None if occ is None else tuple(occ)
+        if key not in self._rank_lists:
+            self._rank_lists[key] = [
+                t.excitation_rank(occ=occ) for t in self.terms]
+        return self._rank_lists[key]
+
+    def ranks(self, occ=None):
+        """Return the set of excitation ranks of the terms."""
+        key = None if occ is None else tuple(occ)
+        if key not in self._rank_sets:
+            self._rank_sets[key] = set(self._ranks(occ))
+        return self._rank_sets[key]
+
+    def _iter(self, targets, occ):
+        # (term, rank) pairs with rank in targets, None means any rank
+        for t, r in zip(self.terms, self._ranks(occ)):
+            if targets is None or r is None or r in targets:
+                yield t, r
+
+    def iter_terms(self, occ=None, vacuum=False):
+        """
+        Generate the terms of the expanded expression one at a time.
+
+        occ (list): Names of the occupied spaces
+        vacuum (bool): Only generate the terms whose net excitation rank
+            is zero and the terms with projectors (see
+            Expression.prune_rank)
+        """
+        targets = frozenset([()]) if vacuum else None
+        for t, r in self._iter(targets, occ):
+            yield t
+
+    def expand(self, occ=None, vacuum=False):
+        """Return the expanded Expression (see iter_terms)."""
+        return Expression(list(self.iter_terms(occ=occ, vacuum=vacuum)))
+
+    def __repr__(self):
+        return str(self.expand())
+
+    def __add__(self, other):
+        if isinstance(other, Expression):
+            other = LazyExpression(other)
+        if isinstance(other, LazyExpression):
+            return _LazySum(self._addends() + other._addends())
+        else:
+            return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, Expression):
+            return LazyExpression(other) + self
+        else:
+            return NotImplemented
+
+    def __sub__(self, other):
+        if isinstance(other, (Expression, LazyExpression)):
+            return self + -1*other
+        else:
+            return NotImplemented
+
+    def __rsub__(self, other):
+        if isinstance(other, Expression):
+            return LazyExpression(other) + -1*self
+        else:
+            return NotImplemented
+
+    def __mul__(self, other):
+        if isinstance(other, Number):
+            return _LazyScaled(self, other)
+        if isinstance(other, Expression):
+            other = LazyExpression(other)
+        if isinstance(other, LazyExpression):
+            return _LazyProduct(self, other)
+        else:
+            return NotImplemented
+
+    def __rmul__(self, other):
+        if isinstance(other, Number):
+            return _LazyScaled(self, other)
+        elif isinstance(other, Expression):
+            return _LazyProduct(LazyExpression(other), self)
+        else:
+            return NotImplemented
+
+    def commute(self, other, occ=None):
+        """
+        Return the commutator with an expression.
+
+        If the terms of other commute for the occupied spaces occ (see
+        Expression.commuting), the
+        k-fold nested commutator [..[[A, T], T].., T] is built as the sum
+        over j of (-1)^j C(k, j) T^j A T^(k-j), where each power of T has
+        one product in a fixed order for every multiset of its terms
+        multiplied by the multinomial coefficient. The expanded
+        commutator has the same operator content as the nested
+        products, but no two of its terms differ only by the order of
+        the commuting factors. The same occ must be used to contract
+        the result.
+
+        occ (list): Names of the occupied spaces
+        """
+        if type(other) is LazyExpression:
+            other = Expression(other.terms)
+        if isinstance(other, Expression) and other.commuting(occ=occ):
+            return _LazyCommutator(self, other, 1, occ=occ)
+        return self*other - other*self
+
+    def _addends(self):
+        return [self]
+
+
+class _LazySum(LazyExpression):
+    def __init__(self, args):
+        self.args = args
+        self._rank_sets = {}
+
+    def ranks(self, occ=None):
+        key = None if occ is None else tuple(occ)
+        if key not in self._rank_sets:
+            ranks = set()
+            for a in self.args:
+                ranks |= a.ranks(occ=occ)
+            self._rank_sets[key] = ranks
+        return self._rank_sets[key]
+
+    def _iter(self, targets, occ):
+        for a in self.args:
+            yield from a._iter(targets, occ)
+
+    def _addends(self):
+        return self.args
+
+
+class _LazyScaled(LazyExpression):
+    def __init__(self, arg, scalar):
+        self.arg = arg
+        self.scalar = scalar
+
+    def ranks(self, occ=None):
+        return self.arg.ranks(occ=occ)
+
+    def _iter(self, targets, occ):
+        for t, r in self.arg._iter(targets, occ):
+            yield t*self.scalar, r
+
+
+class _LazyProduct(LazyExpression):
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self._rank_sets = {}
+
+    def ranks(self, occ=None):
+        key = None if occ is None else tuple(occ)
+        if key not in self._rank_sets:
+            self._rank_sets[key] = {
+                _add_ranks(r1, r2) for r1, r2 in product(
+                    self.left.ranks(occ=occ), self.right.ranks(occ=occ))}
+        return self._rank_sets[key]
+
+    def _iter(self, targets, occ):
+        rranks = self.right.ranks(occ=occ)
+        if targets is None or None in rranks:
+            ltargets = None
+        else:
+            ltargets = frozenset(
+                _add_ranks(r, _neg_rank(r2))
+                for r in targets for r2 in rranks)
+
+        # The right-hand terms needed by each left-hand rank are generated
+        # again for every left-hand term, unless the same rank has been
+        # seen before. They are only stored (with their index sets and
+        # shifted copies) when they are used a second time.
+        seen = set()
+        stored = {}
+        for t1, r1 in self.left._iter(ltargets, occ):
+            if targets is None or r1 is None:
+                rtargets = None
+            else:
+                rtargets = frozenset(
+                    _add_ranks(r, _neg_rank(r1)) for r in targets)
+            info1 = t1._index_info()
+            if rtargets in stored:
+                right = stored[rtargets]
+            elif rtargets in seen:
+                right = stored[rtargets] = [
+                    (t2, r2, t2._index_info(), {})
+                    for t2, r2 in self.right._iter(rtargets, occ)]
+            else:
+                seen.add(rtargets)
+                for t2, r2 in self.right._iter(rtargets, occ):
+                    new = _relabeled(t2, info1, t2._index_info())
+                    yield t1._join(new), _add_ranks(r1, r2)
+                continue
+            for t2, r2, info2, cache in right:
+                new = _relabeled(t2, info1, info2, cache)
+                yield t1._join(new), _add_ranks(r1, r2)
+
+
+def _commuting_power(terms, n):
+    # n-th power of a sum of commuting terms with one product per
+    # multiset of terms
+    out = []
+    for c in combinations_with_replacement(range(len(terms)), n):
+        coeff = factorial(n)
+        for i in set(c):
+            coeff //= factorial(c.count(i))
+        t = terms[c[0]]
+        for i in c[1:]:
+            t = t*terms[i]
+        out.append(t if coeff == 1 else coeff*t)
+    return out
+
+
+class _LazyCommutator(LazyExpression):
+    def __init__(self, arg, cluster, k, occ=None):
+        self.arg = arg
+        self.cluster = cluster
+        self.k = k
+        self.occ = occ
+        self._series = None
+
+    def commute(self, other, occ=None):
+        if type(other) is LazyExpression:
+            other = Expression(other.terms)
+        same = other is self.cluster or other == self.cluster
+        if same and occ == self.occ:
+            return _LazyCommutator(
+                self.arg, self.cluster, self.k + 1, occ=occ)
+        return LazyExpression.commute(self, other, occ=occ)
+
+    def _expression(self):
+        if self._series is None:
+            k = self.k
+            terms = list(self.cluster.terms)
+            powers = [None] + [
+                LazyExpression(Expression(_commuting_power(terms, j)))
+                for j in range(1, k + 1)]
+            args = []
+            for j in range(k + 1):
+                x = self.arg if j == 0 else powers[j]*self.arg
+                if j < k:
+                    x = x*powers[k - j]
+                coeff = (-1)**j*factorial(k)//(factorial(j)*factorial(k - j))
+                args.append(x if coeff == 1 else coeff*x)
+            self._series = _LazySum(args)
+        return self._series
+
+    def ranks(self, occ=None):
+        return self._expression().ranks(occ=occ)
+
+    def _iter(self, targets, occ):
+        return self._expression()._iter(targets, occ)
+
+
+class _TermCollector(object):
+    # Online version of the compression in AExpression.simplify: the terms
+    # are bucketed by contraction pattern and the first term of each
+    # bucket collects the others in order
+    def __init__(self):
+        self.terms = []
+        self.scalars = []
+        self.buckets = {}
+
+    def add(self, t):
+        if all(_is_group(x.sym) for x in t.tensors):
+            key, sign = t.diagram()
+        else:
+            key, sign = None, None
+        reps = self.buckets.setdefault(key, [])
+        for n, t1, s1 in reps:
+            if s1 is not None and sign is not None:
+                x = s1*sign
+            else:
+                x = t1.pmatch(t)
+                if x is None:
+                    continue
+            self.scalars[n] += x*t.scalar
+            return
+        reps.append((len(self.terms), t, sign))
+        self.terms.append(t)
+        self.scalars.append(t.scalar)
+
+    def collect(self):
+        for t, s in zip(self.terms, self.scalars):
+            t.scalar = s
+        return [t.copy() for t in self.terms]
+
 
 class AExpression(object):
     """Abstract tensor expression
@@ -762,6 +1185,17 @@ class AExpression(object):
             filter(lambda x: abs(x.scalar) > self.tthresh, self.terms))
 
         # compress all symmetry-related terms
+        if all(_is_group(t.sym) for x in self.terms for t in x.tensors):
+            self._compress_diagrams()
+        else:
+            self._compress_pmatch()
+
+        # get rid of terms that are zero after compression
+        self.terms = list(
+            filter(lambda x: abs(x.scalar) > self.tthresh, self.terms))
+
+    def _compress_pmatch(self):
+        # compare every term with all of the remaining terms
         newterms = []
 
         def test(x):
@@ -783,9 +1217,11 @@ class AExpression(object):
             self.terms = [remaining[i] for i in indices]
         self.terms = newterms
 
-        # get rid of terms that are zero after compression
-        self.terms = list(
-            filter(lambda x: abs(x.scalar) > self.tthresh, self.terms))
+    def _compress_diagrams(self):
+        collector = _TermCollector()
+        for t in self.terms:
+            collector.add(t)
+        self.terms = collector.collect()
 
     def __repr__(self):
         return self._print_str()
@@ -808,8 +1244,7 @@ class AExpression(object):
                 terms=[other*t for t in self.terms], simplify=False)
             return new
         elif isinstance(other, AExpression):
-            terms = [t1*t2 for t1, t2 in product(self.terms, other.terms)]
-            return AExpression(terms=terms)
+            return AExpression(terms=_products(self.terms, other.terms))
         else:
             return NotImplemented
 
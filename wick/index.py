@@ -1,42 +1,139 @@
 # Copyright (c) 2020-2021 Alec White
 # Licensed under the MIT License (see LICENSE for details)
-from copy import copy
+
+
+class IndexSpace(object):
+    """
+    Orbital or mode space that indices belong to
+
+    Attributes:
+        name (str): Name of the space
+        occupied (bool): Occupied in the reference?
+        fermion (bool): Fermion space?
+        letters (str): Letters used to print indices of the space
+        dim (int): Dimension of the space (optional)
+    """
+    __slots__ = ("name", "occupied", "fermion", "letters", "dim")
+
+    def __init__(self, name, occupied, fermion=True, letters=None, dim=None):
+        self.name = name
+        self.occupied = occupied
+        self.fermion = fermion
+        self.letters = letters
+        self.dim = dim
+
+    def __repr__(self):
+        return "IndexSpace({}, occupied={}, fermion={})".format(
+            self.name, self.occupied, self.fermion)
+
+
+_spaces = {}
+_unset = object()
+
+
+def register_space(name, occupied=_unset, fermion=_unset,
+                   letters=_unset, dim=_unset):
+    """
+    Register an index space, or update a registered one, and return it.
+    Only the attributes that are passed are updated. A new space is
+    occupied if its name contains an 'o', is a Fermion space and has
+    no letters or dimension unless they are passed.
+
+    name (str): Name of the space
+    occupied (bool): Occupied in the reference?
+    fermion (bool): Fermion space? This is the default for indices
+        created after the call.
+    letters (str): Letters used to print indices of the space
+    dim (int): Dimension of the space
+    """
+    space = _spaces.get(name)
+    if space is None:
+        space = IndexSpace(name, 'o' in name)
+        _spaces[name] = space
+    # update in place, existing indices refer to the space
+    if occupied is not _unset:
+        space.occupied = occupied
+    if fermion is not _unset:
+        space.fermion = fermion
+    if letters is not _unset:
+        space.letters = letters
+    if dim is not _unset:
+        space.dim = dim
+    return space
+
+
+def get_space(name):
+    """Return the registered space of this name, registering it if needed"""
+    space = _spaces.get(name)
+    if space is None:
+        space = register_space(name)
+    return space
+
+
+register_space("occ", letters="ijklmnop")
+register_space("vir", letters="abcdefgh")
+register_space("nm", fermion=False, letters="IJKLMNOP")
+
+_space_codes = {}
+_indices = {}
 
 
 class Idx(object):
     """
     Index class
 
+    Indices are interned by (index, space, fermion): constructing the same
+    index twice returns the same object. Spaces are mapped to small integer
+    codes and the hash and sort key are computed once, so hashing and
+    comparing indices does not touch strings.
+
     Attributes:
         index (int): Integer labelling an index as unique
         space (str): Name of the index space
-        fermion (bool): Index of fermiond space?
+        fermion (bool): Index of fermiond space? By default this is
+            taken from the registered space.
+        ispace (IndexSpace): Registered space of the index
     """
-    def __init__(self, index, space, fermion=True):
+    __slots__ = (
+        "index", "space", "fermion", "ispace", "_code", "_hash", "_key")
+
+    def __new__(cls, index, space, fermion=None):
+        if fermion is None:
+            fermion = get_space(space).fermion
+        fermion = bool(fermion)
+        try:
+            return _indices[(index, space, fermion)]
+        except KeyError:
+            pass
+        self = object.__new__(cls)
         self.index = index
         self.space = space
         self.fermion = fermion
+        self.ispace = get_space(space)
+        self._code = _space_codes.setdefault(space, len(_space_codes))
+        self._hash = hash((index, self._code))
+        self._key = (space, index)
+        _indices[(index, space, fermion)] = self
+        return self
+
+    def __reduce__(self):
+        return (Idx, (self.index, self.space, self.fermion))
 
     def __repr__(self):
         return str(self.index) + "(" + self.space + ")"
 
     def __hash__(self):
-        return hash(str(self))
+        return self._hash
 
     def __eq__(self, other):
-        return self.index == other.index\
-            and self.space == other.space
+        return self is other or (
+            self.index == other.index and self._code == other._code)
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __lt__(self, other):
-        if self.space < other.space:
-            return True
-        elif self.space == other.space:
-            return self.index < other.index
-        else:
-            return False
+        return self._key < other._key
 
     def __le__(self, other):
         return self < other or self == other
@@ -50,14 +147,14 @@ class Idx(object):
 
 def idx_copy(idx):
     """
-    Copy an index by making a deep copy of the index (int) and
-    fermion (bool) variables and copying the reference to the space.
+    Copy an index. Indices are never modified after they are created, so
+    the copy is the index itself.
     """
-    return Idx(copy(idx.index), idx.space, bool(idx.fermion))
+    return idx
 
 
 def is_occupied(idx, occ=None):
     if occ is None:
-        return 'o' in idx.space
+        return idx.ispace.occupied
     else:
         return idx.space in occ
@@ -1,16 +1,32 @@
 # Copyright (c) 2020-2021 Alec White
 # Licensed under the MIT License (see LICENSE for details)
 from .index import Idx
-from .index import idx_copy
 from .index import is_occupied
 
 
+def _readonly(self, name, value=None):
+    # operators, sums and deltas are shared between terms instead of
+    # being copied, so they cannot be modified after construction
+    raise AttributeError(
+        "{} objects are shared and cannot be modified".format(
+            type(self).__name__))
+
+
+_set = object.__setattr__
+
+
 class Projector(object):
     """
     Projector onto the vacuum
     """
+    __slots__ = ("idx",)
+    __setattr__ = __delattr__ = _readonly
+
     def __init__(self):
-        self.idx = None
+        _set(self, "idx", None)
+
+    def __reduce__(self):
+        return (Projector, ())
 
     def __eq__(self, other):
         return isinstance(other, Projector)
@@ -42,10 +58,16 @@ class FOperator(object):
         idx (Idx): Index of operator
         ca (Bool): Creation operator?
     """
+    __slots__ = ("idx", "ca")
+    __setattr__ = __delattr__ = _readonly
+
     def __init__(self, idx, ca):
-        self.idx = idx
+        _set(self, "idx", idx)
         assert self.idx.fermion
-        self.ca = ca
+        _set(self, "ca", ca)
+
+    def __reduce__(self):
+        return (type(self), (self.idx, self.ca))
 
     def __eq__(self, other):
         if isinstance(other, FOperator):
@@ -57,6 +79,9 @@ class FOperator(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self.idx, self.ca))
+
     def __repr__(self):
         if self.ca:
             return "a^{\\dagger}_" + str(self.idx)
@@ -65,7 +90,9 @@ class FOperator(object):
 
     def _inc(self, i):
         """Increment indices"""
-        return FOperator(Idx(self.idx.index + i, self.idx.space), self.ca)
+        return FOperator(
+            Idx(self.idx.index + i, self.idx.space, fermion=self.idx.fermion),
+            self.ca)
 
     def _print_str(self, imap):
         if self.ca:
@@ -74,21 +101,16 @@ class FOperator(object):
             return "a_" + imap[self.idx]
 
     def qp_creation(self, occ=None):
-        if (not is_occupied(self.idx, occ=occ)) and self.ca:
-            return True
-        elif (is_occupied(self.idx, occ=occ)) and not self.ca:
-            return True
-        else:
-            return False
+        return is_occupied(self.idx, occ=occ) != self.ca
 
     def qp_annihilation(self, occ=None):
         return not self.qp_creation(occ=occ)
 
     def copy(self):
-        return FOperator(idx_copy(self.idx), self.ca)
+        return self
 
     def dagger(self):
-        return FOperator(idx_copy(self.idx), not self.ca)
+        return FOperator(self.idx, not self.ca)
 
 
 class BOperator(object):
@@ -99,10 +121,16 @@ class BOperator(object):
         idx (Idx): Index of operator
         ca (Bool): Creation operator?
     """
+    __slots__ = ("idx", "ca")
+    __setattr__ = __delattr__ = _readonly
+
     def __init__(self, idx, ca):
-        self.idx = idx
+        _set(self, "idx", idx)
         assert not self.idx.fermion
-        self.ca = ca
+        _set(self, "ca", ca)
+
+    def __reduce__(self):
+        return (type(self), (self.idx, self.ca))
 
     def __eq__(self, other):
         if isinstance(other, BOperator):
@@ -114,6 +142,9 @@ class BOperator(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self.idx, self.ca))
+
     def __repr__(self):
         if self.ca:
             return "b^{\\dagger}_" + str(self.idx)
@@ -131,17 +162,17 @@ class BOperator(object):
         else:
             return "b_" + imap[self.idx]
 
-    def qp_creation(self):
+    def qp_creation(self, occ=None):
         return self.ca
 
-    def qp_annihilation(self):
+    def qp_annihilation(self, occ=None):
         return not self.qp_creation()
 
     def copy(self):
-        return BOperator(idx_copy(self.idx), self.ca)
+        return self
 
     def dagger(self):
-        return BOperator(idx_copy(self.idx), not self.ca)
+        return BOperator(self.idx, not self.ca)
 
 
 class TensorSym(object):
@@ -168,6 +199,8 @@ class Tensor(object):
         name (str): Name of the tensor
         sym (TensorSym): Permutational symmetry of tensor
     """
+    __slots__ = ("indices", "name", "sym")
+
     def __init__(self, indices, name, sym=None):
         self.indices = indices
         self.name = name
@@ -210,10 +243,7 @@ class Tensor(object):
         return not self < other
 
     def __hash__(self):
-        ss = str(self.name)
-        for i in self.indices:
-            ss += str(i)
-        return hash(ss)
+        return hash((self.name, tuple(self.indices)))
 
     def __repr__(self):
         istr = str()
@@ -222,7 +252,9 @@ class Tensor(object):
         return self.name + "_{" + istr + "}"
 
     def _inc(self, i):
-        indices = [Idx(ii.index + i, ii.space) for ii in self.indices]
+        indices = [
+            Idx(ii.index + i, ii.space, fermion=ii.fermion)
+            for ii in self.indices]
         return Tensor(indices, self.name, sym=self.sym)
 
     def ilist(self):
@@ -255,8 +287,7 @@ class Tensor(object):
         self.indices = newindices
 
     def copy(self):
-        newindices = [idx_copy(i) for i in self.indices]
-        return Tensor(newindices, self.name, self.sym)
+        return Tensor(list(self.indices), self.name, self.sym)
 
 
 def permute(t, p):
@@ -273,8 +304,14 @@ class Sigma(object):
     Attributes:
         idx (Idx): Summed index
     """
+    __slots__ = ("idx",)
+    __setattr__ = __delattr__ = _readonly
+
     def __init__(self, idx):
-        self.idx = idx
+        _set(self, "idx", idx)
+
+    def __reduce__(self):
+        return (Sigma, (self.idx,))
 
     def __eq__(self, other):
         if isinstance(other, Sigma):
@@ -298,19 +335,20 @@ class Sigma(object):
         return self.idx >= other.idx
 
     def __hash__(self):
-        return hash(str(self.idx))
+        return hash(self.idx)
 
     def __repr__(self):
         return "\\sum_{" + str(self.idx.index) + "}"
 
     def _inc(self, i):
-        return Sigma(Idx(self.idx.index + i, self.idx.space))
+        return Sigma(
+            Idx(self.idx.index + i, self.idx.space, fermion=self.idx.fermion))
 
     def _print_str(self, imap):
         return "\\sum_{" + imap[self.idx] + "}"
 
     def copy(self):
-        return Sigma(idx_copy(self.idx))
+        return self
 
 
 class Delta(object):
@@ -321,10 +359,16 @@ class Delta(object):
         i1 (Idx): First index
         i2 (Idx): Second index
     """
+    __slots__ = ("i1", "i2")
+    __setattr__ = __delattr__ = _readonly
+
     def __init__(self, i1, i2):
         assert i1.space == i2.space
-        self.i1 = i1
-        self.i2 = i2
+        _set(self, "i1", i1)
+        _set(self, "i2", i2)
+
+    def __reduce__(self):
+        return (Delta, (self.i1, self.i2))
 
     def __eq__(self, other):
         if isinstance(other, Delta):
@@ -337,7 +381,8 @@ class Delta(object):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash(''.join(sorted(str(self.i1.index) + str(self.i2.index))))
+        # independent of the order of the indices
+        return hash(self.i1) ^ hash(self.i2)
 
     def __repr__(self):
         istr = str(self.i1.index) + "," + str(self.i2.index)
@@ -345,16 +390,14 @@ class Delta(object):
 
     def _inc(self, i):
         return Delta(
-            Idx(self.i1.index + i, self.i1.space),
-            Idx(self.i2.index + i, self.i2.space))
+            Idx(self.i1.index + i, self.i1.space, fermion=self.i1.fermion),
+            Idx(self.i2.index + i, self.i2.space, fermion=self.i2.fermion))
 
     def _print_str(self, imap):
         return "\\delta_{" + imap[self.i1] + imap[self.i2] + "}"
 
     def copy(self):
-        i1 = idx_copy(self.i1)
-        i2 = idx_copy(self.i2)
-        return Delta(i1, i2)
+        return self
 
 
 def tensor_from_delta(d):
@@ -374,20 +417,29 @@ def is_normal_ordered(operators, occ):
 
 
 def normal_ordered(operators, occ=None, sign=1):
-    if is_normal_ordered(operators, occ):
+    """
+    Return the normal-ordered form of a string of fermion and boson
+    operators and the sign of the reordering.
+
+    The quasi-particle creation operators are moved to the left of the
+    annihilation operators, keeping the relative order within each group.
+    Only fermion annihilators passed by fermion creators change the sign.
+    """
+    creators = []
+    annihilators = []
+    nf = 0
+    ncross = 0
+    for op in operators:
+        fermion = op.idx.fermion
+        if op.qp_creation(occ):
+            creators.append(op)
+            if fermion:
+                ncross += nf
+        else:
+            annihilators.append(op)
+            if fermion:
+                nf += 1
+    if not annihilators or not creators:
         return (operators, sign)
-    fa = None
-    swap = None
-    for i, op in enumerate(operators):
-        assert isinstance(op, FOperator)
-        if fa is None and (not op.qp_creation(occ)):
-            fa = i
-        if fa is not None and op.qp_creation(occ):
-            swap = i
-            break
-    assert swap is not None
-    newops = operators[:fa] + [operators[swap]]\
-        + operators[fa:swap] + operators[swap + 1:]
-    newsign = 1 if len(operators[fa:swap]) % 2 == 0 else -1
-    sign = sign*newsign
-    return normal_ordered(newops, sign=sign)
+    newsign = 1 if ncross % 2 == 0 else -1
+    return (creators + annihilators, sign*newsign)
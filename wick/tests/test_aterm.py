@@ -1,7 +1,8 @@
 import unittest
 
 from wick.index import Idx
-from wick.operator import Tensor, Delta, Sigma, tensor_from_delta
+from wick.operator import Tensor, Delta, Sigma, TensorSym
+from wick.operator import tensor_from_delta
 from wick.expression import AExpression, ATerm
 from wick.convenience import one_e, two_e, braE2, braE1, ketE1
 from wick.convenience import E0, E1, E2
@@ -177,6 +178,43 @@ class ATermTest(unittest.TestCase):
         self.assertTrue(t1 > t3)
         self.assertTrue(t3 < t4)
 
+    def test_diagram(self):
+        H = one_e("f", ["occ", "vir"], norder=True)
+        H += two_e("I", ["occ", "vir"], norder=True)
+        T = E1("t", ["occ"], ["vir"]) + E2("t", ["occ"], ["vir"])
+        bra = braE2("occ", "vir", "occ", "vir")
+        out = apply_wick(bra*(H + H*T))
+        out.resolve()
+        terms = AExpression(Ex=out, simplify=False, sort=False).terms
+        for t in terms[:10]:
+            key, sign = t.diagram()
+            t2 = t._inc(5)
+            t2.tensors.reverse()
+            key2, sign2 = t2.diagram()
+            self.assertTrue(key == key2)
+            self.assertTrue(sign*sign2 == t.pmatch(t2))
+
+        ref = AExpression(terms=[t.copy() for t in terms], simplify=False)
+        ref._compress_pmatch()
+        final = AExpression(terms=[t.copy() for t in terms], simplify=False)
+        final._compress_diagrams()
+        self.assertTrue(len(final.terms) < len(terms))
+        self.assertTrue(final == ref)
+
+    def test_list_permutations(self):
+        a = Idx(0, "vir")
+        b = Idx(1, "vir")
+        sym = TensorSym([[0, 1], [1, 0]], [1, -1])
+        sums = [Sigma(a), Sigma(b)]
+        x = Tensor([a, b], 'x')
+        t1 = ATerm(sums=sums, tensors=[Tensor([a, b], 'g', sym=sym), x])
+        t2 = ATerm(sums=sums, tensors=[Tensor([b, a], 'g', sym=sym), x])
+        out = AExpression(terms=[t1.copy(), t2])
+        self.assertTrue(len(out.terms) == 0)
+        out = AExpression(terms=[t1.copy(), t1.copy()])
+        self.assertTrue(len(out.terms) == 1)
+        self.assertTrue(out.terms[0].scalar == 2)
+
     def test_string(self):
         a = Idx(0, "vir")
         b = Idx(1, "vir")
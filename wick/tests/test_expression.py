@@ -2,7 +2,10 @@ import unittest
 
 from wick.index import Idx
 from wick.operator import FOperator, Sigma, Tensor, Delta
-from wick.expression import Term, Expression
+from wick.expression import Term, Expression, AExpression, LazyExpression
+from wick.convenience import one_e, two_e, E1, E2, braE1, braE2
+from wick.convenience import commute
+from wick.wick import apply_wick
 
 
 class ExpressionTest(unittest.TestCase):
@@ -107,6 +110,24 @@ class ExpressionTest(unittest.TestCase):
 
         self.assertTrue(ref == out)
 
+    def test_resolve_classes(self):
+        i = Idx(0, "occ")
+        j = Idx(1, "occ")
+        k = Idx(2, "occ")
+        l = Idx(3, "occ")
+        m = Idx(4, "occ")
+        out = Term(
+            1, [Sigma(j), Sigma(l), Sigma(m)],
+            [Tensor([i, j, k], "T"), Tensor([l, m], "U")],
+            [], [Delta(j, i), Delta(k, j), Delta(l, m), Delta(m, l)])
+        out.resolve()
+
+        ref = Term(
+            1, [Sigma(l)],
+            [Tensor([i, i, k], "T"), Tensor([l, l], "U")],
+            [], [Delta(i, k)])
+        self.assertTrue(ref == out)
+
     def test_str(self):
         i = Idx(0, "occ")
         j = Idx(1, "occ")
@@ -123,6 +144,97 @@ class ExpressionTest(unittest.TestCase):
         ref = " + 1\\sum_{i}\\delta_{ij}X_{ij}a_i"
         self.assertTrue(ref == out)
 
+    def test_vacuum_multiply(self):
+        H = one_e("f", ["occ", "vir"], norder=True)
+        H += two_e("I", ["occ", "vir"], norder=True)
+        T = E1("t", ["occ"], ["vir"]) + E2("t", ["occ"], ["vir"])
+        HT = commute(H, T)
+        bra = braE2("occ", "vir", "occ", "vir")
+        ref = bra*HT
+        out = bra.multiply(HT, vacuum=True)
+        self.assertTrue(len(out.terms) < len(ref.terms))
+        self.assertTrue(apply_wick(out) == apply_wick(ref))
+
+        ref.prune_rank()
+        self.assertTrue(ref == out)
+
+    def test_multiply_shared(self):
+        H = one_e("f", ["occ", "vir"], norder=True)
+        H += two_e("I", ["occ", "vir"], norder=True)
+        T = E1("t", ["occ"], ["vir"]) + E2("t", ["occ"], ["vir"])
+        out = H*T
+        ref = Expression([t1*t2 for t1 in H.terms for t2 in T.terms])
+        self.assertTrue(out == ref)
+        for t1, t2 in zip(out.terms, ref.terms):
+            self.assertTrue(t1.ilist() == t2.ilist())
+
+    def test_lazy(self):
+        H = one_e("f", ["occ", "vir"], norder=True)
+        H += two_e("I", ["occ", "vir"], norder=True)
+        T = E1("t", ["occ"], ["vir"]) + E2("t", ["occ"], ["vir"])
+        bra = braE2("occ", "vir", "occ", "vir")
+        HT = H*T - T*H
+        HTT = HT*T - T*HT
+        ref = bra*(H + HT + 0.5*HTT)
+        L = LazyExpression(H)
+        LT = L*T - T*L
+        LTT = LT*T - T*LT
+        out = bra*(L + LT + 0.5*LTT)
+        self.assertTrue(out.expand() == ref)
+        self.assertTrue(LTT.expand() == HTT)
+
+        ref.prune_rank()
+        self.assertTrue(out.expand(vacuum=True) == ref)
+        self.assertTrue(apply_wick(out) == apply_wick(ref))
+
+    def test_commuting(self):
+        H = one_e("f", ["occ", "vir"], norder=True)
+        H += two_e("I", ["occ", "vir"], norder=True)
+        T1 = E1("t", ["occ"], ["vir"])
+        T = T1 + E2("t", ["occ"], ["vir"])
+        self.assertTrue(T.commuting() and (0.5*T).commuting())
+        self.assertFalse((H + T).commuting())
+
+        bra = braE2("occ", "vir", "occ", "vir")
+        ref = bra*commute(commute(commute(H, T), T), T)
+        L = commute(commute(commute(LazyExpression(H), T), T), T)
+        out = bra*L
+        self.assertTrue(len(out.expand().terms) < len(ref.terms))
+        ref = apply_wick(ref)
+        ref.resolve()
+        out = apply_wick(out)
+        out.resolve()
+        self.assertTrue(AExpression(Ex=ref) == AExpression(Ex=out))
+
+        # HT1T1 - 2T1HT1 + T1T1H and T^2 has T1T1, 2T1T2 and T2T2
+        L = commute(commute(LazyExpression(H), T1), T1)
+        self.assertTrue(len(L.expand().terms) == 3*len(H.terms))
+        L = commute(commute(LazyExpression(H), T), T)
+        self.assertTrue(len(L.expand().terms) == 10*len(H.terms))
+
+        # excitations and de-excitations do not commute
+        X = T1 + E1("L", ["vir"], ["occ"])
+        self.assertFalse(X.commuting())
+        bra = braE1("occ", "vir")
+        ref = bra*commute(commute(H, X), X)
+        out = bra*commute(commute(LazyExpression(H), X), X)
+        self.assertTrue(out.expand() == ref)
+
+        # the occupied spaces can be given instead of registered
+        occ = ["p"]
+        H = one_e("f", ["p", "q"]) + two_e("I", ["p", "q"])
+        T = E1("t", ["p"], ["q"]) + E2("t", ["p"], ["q"])
+        self.assertFalse(T.commuting())
+        self.assertTrue(T.commuting(occ=occ))
+        bra = braE1("p", "q")
+        ref = apply_wick(bra*commute(commute(H, T), T), occ=occ)
+        ref.resolve()
+        L = commute(commute(LazyExpression(H), T, occ=occ), T, occ=occ)
+        self.assertTrue(len(L.expand().terms) == 10*len(H.terms))
+        out = apply_wick(bra*L, occ=occ)
+        out.resolve()
+        self.assertTrue(AExpression(Ex=ref) == AExpression(Ex=out))
+
 
 if __name__ == '__main__':
     unittest.main()
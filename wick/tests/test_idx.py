@@ -1,6 +1,10 @@
+import pickle
 import unittest
 
 from wick.index import Idx, is_occupied, idx_copy
+from wick.index import get_space, register_space
+from wick.operator import Sigma, Tensor
+from wick.expression import ATerm
 
 
 class IdxTest(unittest.TestCase):
@@ -43,6 +47,56 @@ class IdxTest(unittest.TestCase):
         self.assertFalse(i < idx_copy(i))
         self.assertTrue(b >= a)
 
+    def test_idx_intern(self):
+        i = Idx(0, "occ")
+        x = Idx(0, "occ", fermion=False)
+        self.assertTrue(Idx(0, "occ") is i)
+        self.assertTrue(pickle.loads(pickle.dumps(i)) is i)
+        self.assertTrue(x is not i)
+        self.assertTrue(x == i)
+        self.assertTrue(hash(x) == hash(i))
+        self.assertFalse(x.fermion)
+        self.assertTrue(i.fermion)
+
+    def test_space_registry(self):
+        self.assertTrue(get_space("occ").occupied)
+        self.assertFalse(get_space("vir").occupied)
+        self.assertFalse(get_space("nm").fermion)
+        self.assertTrue(get_space("oa").occupied)
+        self.assertFalse(get_space("va").occupied)
+
+        x = Idx(0, "core2")
+        self.assertTrue(is_occupied(x))
+        space = register_space("core2", occupied=False, letters="pqr")
+        self.addCleanup(register_space, "core2", occupied=True, letters=None)
+        self.assertTrue(x.ispace is space)
+        self.assertFalse(is_occupied(x))
+        self.assertTrue(is_occupied(x, occ=["core2"]))
+
+        sums = [Sigma(x)]
+        tensors = [Tensor([x], "f")]
+        t = ATerm(sums=sums, tensors=tensors)
+        self.assertTrue(t._print_str() == "1.0\\sum_{p}f_{p}")
+
+        # only the given attributes are updated
+        space = register_space("occ", dim=10)
+        self.addCleanup(register_space, "occ", dim=None)
+        self.assertTrue(space.letters == "ijklmnop")
+        self.assertTrue(space.occupied and space.fermion)
+        self.assertTrue(space.dim == 10)
+
+        # built-in spaces are printed with their registered letters
+        i = Idx(0, "occ")
+        t = ATerm(sums=[Sigma(i)], tensors=[Tensor([i], "f")])
+        self.assertTrue(t._print_str() == "1.0\\sum_{i}f_{i}")
+        register_space("occ", letters="IJK")
+        self.addCleanup(register_space, "occ", letters="ijklmnop")
+        self.assertTrue(t._print_str() == "1.0\\sum_{I}f_{I}")
+
+        # boson spaces give boson indices by default
+        self.assertFalse(Idx(5, "nm").fermion)
+        self.assertTrue(Idx(5, "nm") is Idx(5, "nm", fermion=False))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,7 +2,7 @@ import unittest
 
 from wick.index import Idx
 from wick.operator import FOperator, BOperator, Projector
-from wick.operator import Delta, Tensor, Sigma
+from wick.operator import Delta, Tensor, Sigma, normal_ordered
 
 
 class OperatorTest(unittest.TestCase):
@@ -145,6 +145,69 @@ class OperatorTest(unittest.TestCase):
         sd1 = "\\delta_{0,1}"
         self.assertTrue(str(D1) == sd1)
 
+    def test_copy(self):
+        i = Idx(0, "occ")
+        j = Idx(1, "occ")
+        O1 = FOperator(i, True)
+        S1 = Sigma(i)
+        D1 = Delta(i, j)
+        self.assertTrue(O1.copy() is O1)
+        self.assertTrue(S1.copy() is S1)
+        self.assertTrue(D1.copy() is D1)
+        self.assertTrue(hash(D1) == hash(Delta(j, i)))
+        self.assertTrue(hash(O1) == hash(FOperator(Idx(0, "occ"), True)))
+
+        # shared objects cannot be modified
+        with self.assertRaises(AttributeError):
+            O1.copy().idx = j
+        with self.assertRaises(AttributeError):
+            D1.copy().i1 = j
+        with self.assertRaises(AttributeError):
+            S1.copy().idx = j
+        self.assertTrue(O1.idx is i and D1.i1 is i and S1.idx is i)
+
+        T1 = Tensor([i, j], "f")
+        T2 = T1.copy()
+        T2.transpose((1, 0))
+        self.assertTrue(T1.indices == [i, j])
+        self.assertTrue(T2.indices == [j, i])
+        with self.assertRaises(AttributeError):
+            T1.foo = 1
+
+    def test_normal_ordered(self):
+        i = Idx(0, "occ")
+        j = Idx(1, "occ")
+        a = Idx(0, "vir")
+        b = Idx(1, "vir")
+        x = Idx(0, "nm", fermion=False)
+        ops = [FOperator(a, False), FOperator(i, True),
+               FOperator(b, True), FOperator(j, False)]
+        out, sign = normal_ordered(ops)
+        self.assertTrue(out == [ops[2], ops[3], ops[0], ops[1]])
+        self.assertTrue(sign == 1)
+        out, sign = normal_ordered(ops[:3])
+        self.assertTrue(out == [ops[2], ops[0], ops[1]])
+        self.assertTrue(sign == 1)
+        out, sign = normal_ordered(ops[1:])
+        self.assertTrue(out == [ops[2], ops[3], ops[1]])
+        self.assertTrue(sign == 1)
+        out, sign = normal_ordered(ops[:2] + ops[3:])
+        self.assertTrue(out == [ops[3], ops[0], ops[1]])
+        self.assertTrue(sign == 1)
+        out, sign = normal_ordered(ops[:1] + ops[2:3])
+        self.assertTrue(out == [ops[2], ops[0]])
+        self.assertTrue(sign == -1)
+
+        # bosons commute with fermions
+        bx = BOperator(x, False)
+        bxd = BOperator(x, True)
+        out, sign = normal_ordered([bx, ops[0], bxd, ops[2]])
+        self.assertTrue(out == [bxd, ops[2], bx, ops[0]])
+        self.assertTrue(sign == -1)
+        out, sign = normal_ordered([bxd, bx], sign=-1)
+        self.assertTrue(out == [bxd, bx])
+        self.assertTrue(sign == -1)
+
     def test_inc(self):
         i = Idx(0, "occ")
         j = Idx(1, "occ")
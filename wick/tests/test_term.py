@@ -2,7 +2,7 @@ import unittest
 
 from wick.index import Idx
 from wick.expression import Term
-from wick.operator import FOperator, Sigma, Tensor
+from wick.operator import FOperator, BOperator, Projector, Sigma, Tensor
 
 
 class TermTest(unittest.TestCase):
@@ -71,6 +71,23 @@ class TermTest(unittest.TestCase):
         ttest = Term(s, sums, tensors, operators, [])
         self.assertTrue(t3 == ttest)
 
+    def test_excitation_rank(self):
+        i = Idx(0, "occ")
+        a = Idx(0, "vir")
+        x = Idx(0, "nm", fermion=False)
+        operators = [FOperator(a, True), FOperator(i, False)]
+        t = Term(1, [], [], operators, [])
+        self.assertTrue(
+            t.excitation_rank() == ((("occ", True), 1), (("vir", True), 1)))
+        self.assertTrue(t.excitation_rank(occ=["occ", "vir"]) == (
+            (("occ", True), 1), (("vir", True), -1)))
+        operators = [
+            BOperator(x, True), FOperator(i, True), FOperator(i, False)]
+        t = Term(1, [], [], operators, [])
+        self.assertTrue(t.excitation_rank() == ((("nm", False), 1),))
+        t = Term(1, [], [], [FOperator(i, True), Projector()], [])
+        self.assertTrue(t.excitation_rank() is None)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,29 @@
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 from wick.index import Idx
-from wick.expression import Term, Expression, AExpression
-from wick.operator import FOperator, BOperator, Projector
-from wick.wick import valid_contraction, pair_list
-from wick.wick import get_sign, split_operators, apply_wick
-from wick.convenience import one_e
+from wick.expression import Term, Expression, AExpression, LazyExpression
+from wick.operator import FOperator, BOperator, Projector, Delta, Tensor
+from wick.wick import valid_contraction, pair_list, iter_pairs
+from wick.wick import get_sign, split_operators, apply_wick, derive
+from wick.wick import project
+from wick.wick import vacuum_possible, contractions
+from wick.wick import contraction_sign, ContractionCache
+from wick.wick import max_stored_pairings
+from wick.wick import operator_signature, contraction_templates
+from wick.wick import diagram_templates
+from wick.wick import count_contractions, estimate_wick, estimate_product
+from wick.convenience import one_e, two_e, E1, E2, ketE1, braE1, commute
+from wick.convenience import two_p, P2, braP2
+
+
+def _per_pairing_reference(S):
+    # contracted terms of S with one term per pairing
+    terms = []
+    for t in S.terms:
+        for deltas, sign in contractions(t.operators):
+            terms.append(Term(sign*t.scalar, t.sums, t.tensors, [], deltas))
+    return Expression(terms)
 
 
 class WickTest(unittest.TestCase):
@@ -50,6 +68,37 @@ class WickTest(unittest.TestCase):
         pl = pair_list(os)
         self.assertTrue(len(pl) == 1)
 
+    def test_iter_pairs(self):
+        i = Idx(0, "occ")
+        j = Idx(1, "occ")
+        a = Idx(0, "vir")
+        b = Idx(1, "vir")
+        os = [
+            FOperator(i, True), FOperator(a, False), FOperator(j, True),
+            FOperator(b, False), FOperator(j, False), FOperator(a, True),
+            FOperator(i, False), FOperator(b, True)]
+        it = iter_pairs(os)
+        self.assertTrue(next(it) == pair_list(os)[0])
+        self.assertTrue(list(iter_pairs(os)) == pair_list(os))
+        self.assertTrue(len(pair_list(os)) == 4)
+
+    def test_vacuum_possible(self):
+        i = Idx(0, "occ")
+        a = Idx(0, "vir")
+        x = Idx(0, "nm", fermion=False)
+        Oi = FOperator(i, True)
+        Oid = FOperator(i, False)
+        Oa = FOperator(a, False)
+        Oad = FOperator(a, True)
+        Ox = BOperator(x, False)
+        Oxd = BOperator(x, True)
+        self.assertTrue(vacuum_possible([Oi, Oa, Oad, Oid]))
+        self.assertTrue(vacuum_possible([Ox, Oi, Oid, Oxd]))
+        self.assertFalse(vacuum_possible([Oi, Oa, Oad, Oad]))
+        self.assertFalse(vacuum_possible([Oid, Oi]))
+        self.assertFalse(vacuum_possible([Ox, Oid]))
+        self.assertTrue(vacuum_possible([Oid, Oi], occ=["vir"]))
+
     def test_get_sign(self):
         ipairs = [(0, 1), (2, 3)]
         self.assertTrue(get_sign(ipairs) == 1)
@@ -57,6 +106,121 @@ class WickTest(unittest.TestCase):
         ipairs = [(0, 2), (1, 3)]
         self.assertTrue(get_sign(ipairs) == -1)
 
+        ipairs = [(0, 5), (1, 3), (2, 4)]
+        self.assertTrue(get_sign(ipairs) == -1)
+
+    def test_contraction_sign(self):
+        i = Idx(0, "occ")
+        j = Idx(1, "occ")
+        k = Idx(2, "occ")
+        l = Idx(3, "occ")
+        a = Idx(0, "vir")
+        b = Idx(1, "vir")
+        c = Idx(2, "vir")
+        d = Idx(3, "vir")
+        ops = [
+            FOperator(i, True), FOperator(j, True),
+            FOperator(b, False), FOperator(a, False),
+            FOperator(c, True), FOperator(d, True),
+            FOperator(l, False), FOperator(k, False)]
+        cs = list(contractions(ops))
+        self.assertTrue(len(cs) == 4)
+        for deltas, sign in cs:
+            pairs = []
+            for dd in deltas:
+                pi = [n for n, o in enumerate(ops) if o.idx == dd.i1][0]
+                pj = [n for n, o in enumerate(ops) if o.idx == dd.i2][0]
+                pairs.append((pi, pj))
+            self.assertTrue(contraction_sign(ops, pairs) == sign)
+            self.assertTrue(get_sign(pairs) == sign)
+
+    def test_normal_ordered_factors(self):
+        h = one_e("f", ["occ", "vir"], norder=True)
+        T = E2("t", ["occ"], ["vir"])
+        bra = braE1("occ", "vir")
+        e = bra*h*T
+        for t in e.terms:
+            ops = t.operators
+            bounds = [0, 2, 4, 8]
+            factor = [sum(n >= b for b in bounds) for n in range(len(ops))]
+            sig = operator_signature(ops)
+            ref = pair_list(ops)
+            templates = contraction_templates(sig)
+            self.assertTrue(len(templates) == len(ref))
+            for pairs, sign in templates:
+                pairs = list(pairs)
+                self.assertTrue(all(factor[i] != factor[j] for i, j in pairs))
+                self.assertTrue(contraction_sign(ops, pairs) == sign)
+
+    def test_mixed_species(self):
+        i = Idx(0, "occ")
+        a = Idx(0, "vir")
+        x = Idx(0, "nm", fermion=False)
+        ops = [
+            FOperator(i, True), BOperator(x, False), FOperator(a, False),
+            FOperator(a, True), BOperator(x, True), FOperator(i, False)]
+        cs = list(contractions(ops))
+        self.assertTrue(len(cs) == 1)
+        self.assertTrue(len(cs[0][0]) == 3)
+        self.assertTrue(cs[0][1] == 1)
+
+    def test_stream_contractions(self):
+        ij = [Idx(n, "occ") for n in range(5)]
+        ab = [Idx(n, "vir") for n in range(4)]
+        # occ and vir quasi-particle annihilators, then creators
+        ops = [FOperator(ij[0], True)]
+        for i, a in zip(ij[1:], ab):
+            ops += [FOperator(a, False), FOperator(i, True)]
+        for i, a in zip(ij[::-1], ab):
+            ops += [FOperator(a, True), FOperator(i, False)]
+        ops += [FOperator(ij[0], False)]
+        cache = ContractionCache()
+        cs = contractions(ops, cache=cache)
+        ref = pair_list(ops)
+        self.assertTrue(len(ref) > max_stored_pairings)
+        n = 0
+        for (deltas, sign), pairs in zip(cs, ref):
+            self.assertTrue(deltas == [Delta(x.idx, y.idx) for x, y in pairs])
+            n += 1
+        self.assertTrue(n == len(ref))
+        self.assertTrue(len(cache) == 0 and cache.misses == 0)
+
+    def test_contraction_cache(self):
+        i = Idx(0, "occ")
+        j = Idx(1, "occ")
+        a = Idx(0, "vir")
+        b = Idx(1, "vir")
+        x = Idx(0, "nm", fermion=False)
+        ops1 = [FOperator(i, True), FOperator(a, False),
+                FOperator(a, True), FOperator(i, False)]
+        ops2 = [FOperator(j, True), FOperator(b, False),
+                FOperator(b, True), FOperator(j, False)]
+        ops3 = [BOperator(x, False), BOperator(x, True)]
+        cache = ContractionCache(maxsize=1)
+        c1 = list(contractions(ops1, cache=cache))
+        c2 = list(contractions(ops2, cache=cache))
+        self.assertTrue(cache.hits == 1 and cache.misses == 1)
+        self.assertTrue(len(c1) == len(c2) == 1)
+        self.assertTrue(c2[0][0] == [Delta(b, b), Delta(j, j)])
+        list(contractions(ops3, cache=cache))
+        list(contractions(ops1, cache=cache))
+        self.assertTrue(cache.misses == 3)
+        self.assertTrue(len(cache) == 1)
+        cache.clear()
+        self.assertTrue(cache.hits == 0 and len(cache) == 0)
+
+        # the total number of templates is bounded too
+        ops4 = ops1[:2] + ops2[:2] + ops1[2:] + ops2[2:]
+        cache = ContractionCache(maxtemplates=2)
+        self.assertTrue(len(list(contractions(ops4, cache=cache))) == 4)
+        self.assertTrue(len(cache) == 0)
+        list(contractions(ops1, cache=cache))
+        list(contractions(ops3, cache=cache))
+        self.assertTrue(len(cache) == 2)
+        ops5 = ops3[:1] + ops3 + ops3[1:]
+        self.assertTrue(len(list(contractions(ops5, cache=cache))) == 2)
+        self.assertTrue(len(cache) == 1)
+
     def test_split_operators(self):
         i = Idx(0, "occ")
         j = Idx(1, "occ")
@@ -75,6 +239,167 @@ class WickTest(unittest.TestCase):
         self.assertTrue(olists[1] == [O3])
         self.assertTrue(olists[2] == [O4])
 
+    def test_parallel(self):
+        h = one_e("f", ["occ", "vir"], norder=True)
+        g = one_e("g", ["occ", "vir"], norder=True)
+        e = h*g*h
+        ref = apply_wick(e)
+        out = apply_wick(e, nproc=2)
+        self.assertTrue(len(ref.terms) > 0)
+        self.assertTrue(ref == out)
+
+        # threads share the cache, processes fill their own copy
+        cache = ContractionCache(maxsize=2)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            out = apply_wick(e, cache=cache, executor=pool, nproc=4)
+        self.assertTrue(ref == out)
+        self.assertTrue(cache.misses > 0 and len(cache) <= 2)
+        cache = ContractionCache(maxsize=2)
+        self.assertTrue(apply_wick(e, cache=cache, nproc=2) == ref)
+        self.assertTrue(cache.hits == 0 and cache.misses == 0)
+
+    def test_connected(self):
+        H = one_e("f", ["occ", "vir"], norder=True)
+        H += two_e("I", ["occ", "vir"], norder=True)
+        T = E1("t", ["occ"], ["vir"]) + E2("t", ["occ"], ["vir"])
+        L = E1("L", ["vir"], ["occ"])
+        ket = ketE1("occ", "vir")
+        S = L*(H + commute(H, T))*ket
+        out = apply_wick(S)
+        out.resolve()
+        ref = AExpression(Ex=out).get_connected()
+        out = apply_wick(S, connected=True)
+        nc = len(out.terms)
+        out.resolve()
+        ex = AExpression(Ex=out)
+        self.assertTrue(nc < len(apply_wick(S).terms))
+        self.assertTrue(ex.connected())
+        self.assertTrue(str(ex) == str(ref))
+
+    def test_shared_operators(self):
+        i = Idx(0, "occ")
+        a = Idx(0, "vir")
+        ops = [FOperator(i, True), FOperator(a, False),
+               FOperator(a, True), FOperator(i, False)]
+        t1 = Term(1.0, [], [Tensor([i, a], "f")], ops, [])
+        t2 = Term(2.0, [], [Tensor([a, i], "g")], ops, [])
+        t3 = Term(1.0, [], [Tensor([i, a], "h")], ops[2:] + ops[:2], [])
+        out = apply_wick(Expression([t1, t3, t2]))
+        ref = apply_wick(Expression([t1]))
+        ref += apply_wick(Expression([t3]))
+        ref += apply_wick(Expression([t2]))
+        self.assertTrue(len(out.terms) == 2)
+        self.assertTrue(out == ref)
+
+    def test_boson_multiplicity(self):
+        H = two_p("w")
+        T = P2("S", ["nm"])
+        S = braP2("nm")*(H + commute(H, T) + commute(commute(H, T), T))
+        out = apply_wick(S)
+        nout = len(out.terms)
+        out.resolve()
+        ex = AExpression(Ex=out)
+
+        ref = _per_pairing_reference(S)
+        self.assertTrue(nout < len(ref.terms))
+        ref.resolve()
+        ref = AExpression(Ex=ref)
+        self.assertTrue(str(ex) == str(ref))
+
+    def test_antisymmetric_multiplicity(self):
+        H = two_e("I", ["occ", "vir"], norder=True)
+        T = E2("t", ["occ"], ["vir"])
+        S = braE1("occ", "vir")*(H + commute(H, T))
+        out = apply_wick(S)
+        nout = len(out.terms)
+        out.resolve()
+        ex = AExpression(Ex=out)
+
+        ref = _per_pairing_reference(S)
+        self.assertTrue(nout < len(ref.terms))
+        ref.resolve()
+        ref = AExpression(Ex=ref)
+        self.assertTrue(str(ex) == str(ref))
+
+    def test_derive(self):
+        H = one_e("f", ["occ", "vir"], norder=True)
+        H += two_e("I", ["occ", "vir"], norder=True)
+        T = E1("t", ["occ"], ["vir"]) + E2("t", ["occ"], ["vir"])
+        S = braE1("occ", "vir")*(H + commute(H, T))
+        out = apply_wick(S)
+        out.resolve()
+        ref = AExpression(Ex=out)
+        final = derive(S)
+        self.assertTrue(len(final.terms) > 0)
+        self.assertTrue(final == ref)
+        self.assertTrue(str(final) == str(ref))
+
+    def test_diagrams(self):
+        a = ("occ", True, False)
+        c = ("occ", True, True)
+        sig = (a, a, c, c)
+        ref = contraction_templates(sig)
+        self.assertTrue(diagram_templates(sig, (0, 1, 2, 3)) == ref)
+        self.assertTrue(
+            diagram_templates(sig, (0, 0, 1, 1)) == [(ref[0][0], -2)])
+        self.assertTrue(diagram_templates((a, c, a, c), (0, 1, 0, 1)) is None)
+
+        H = one_e("f", ["occ", "vir"], norder=True)
+        H += two_e("I", ["occ", "vir"], norder=True)
+        T = E1("t", ["occ"], ["vir"]) + E2("t", ["occ"], ["vir"])
+        S = braE1("occ", "vir")*(H + commute(H, T))
+        final = derive(S, diagrams=True)
+        self.assertTrue(len(final.terms) > 0)
+        self.assertTrue(str(final) == str(derive(S)))
+        final = derive(S, connected=True, diagrams=True)
+        self.assertTrue(str(final) == str(derive(S, connected=True)))
+
+    def test_project(self):
+        H = one_e("f", ["occ", "vir"], norder=True)
+        H += two_e("I", ["occ", "vir"], norder=True)
+        bra = braE1("occ", "vir")
+        ket = ketE1("occ", "vir")
+        out = project(H, [(bra, None), (bra, ket), (None, None)])
+        self.assertTrue(len(out) == 3)
+        self.assertTrue(out[0] == derive(bra*H))
+        self.assertTrue(out[1] == derive(bra*H*ket))
+        self.assertTrue(len(out[1].terms) > 0)
+        self.assertTrue(len(out[2].terms) == 0)
+
+        T = E1("t", ["occ"], ["vir"])
+        HT = commute(H, T)
+        LT = commute(LazyExpression(H), T)
+        out = project(LT, [(bra, None), (None, ket)])
+        self.assertTrue(out[0] == derive(bra*HT))
+        self.assertTrue(out[0] == derive(bra*LT))
+        self.assertTrue(out[1] == derive(HT*ket))
+
+    def test_estimate(self):
+        i = Idx(0, "occ")
+        a = Idx(0, "vir")
+        ops = [FOperator(i, True), FOperator(a, False),
+               FOperator(a, True), FOperator(i, False)]
+        self.assertTrue(count_contractions(ops) == 1)
+        ops2 = ops[:2] + ops[:2] + ops[2:] + ops[2:]
+        self.assertTrue(count_contractions(ops2) == 4)
+        self.assertTrue(count_contractions(ops + [Projector()] + ops) == 1)
+        self.assertTrue(count_contractions(ops[1:]) == 0)
+
+        h = one_e("f", ["occ", "vir"], norder=True)
+        g = one_e("g", ["occ", "vir"])
+        e = h*g*h
+        est = estimate_wick(e)
+        self.assertTrue(est.nterms == len(e.terms))
+        self.assertTrue(est.ncontractions == len(apply_wick(e).terms))
+        self.assertTrue(est.memory > 0)
+
+        est = estimate_product(h*g, h)
+        self.assertTrue(est.nterms == len(e.terms))
+        self.assertTrue(est.pairings == estimate_wick(e).pairings)
+        est = estimate_product(h*g, h, vacuum=True)
+        ref = (h*g).multiply(h, vacuum=True)
+        self.assertTrue(est.nterms == len(ref.terms))
+
     def test_projector(self):
         O1 = one_e("f", ["occ", "vir"])
         O2 = one_e("g", ["occ", "vir"])
@@ -85,7 +410,12 @@ class WickTest(unittest.TestCase):
         ref = AExpression(Ex=ref1*ref2)
 
         P = Expression([Term(1, [], [], [Projector()], [])])
-        out1 = apply_wick(O1*P*O2)
+        e = O1*P*O2
+        out1 = apply_wick(e)
+        ref1 = Expression([])
+        for t in e.terms:
+            ref1 += apply_wick(Expression([t]))
+        self.assertTrue(out1 == ref1)
         out1.resolve()
         out = AExpression(Ex=out1)
         self.assertTrue(ref.pmatch(out))
@@ -1,9 +1,17 @@
 # Copyright (c) 2020-2021 Alec White
 # Licensed under the MIT License (see LICENSE for details)
-from itertools import product
-from .operator import BOperator, FOperator, Projector, Delta
-from .expression import Term, Expression
-from .index import is_occupied
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product, repeat
+from math import factorial
+from .operator import BOperator, FOperator, Projector, Delta, Sigma, Tensor
+from .expression import Term, Expression, ATerm, AExpression
+from .expression import LazyExpression
+from .expression import _TermCollector, _add_ranks, _neg_rank
+from .index import Idx, is_occupied
 
 
 def valid_contraction(o1, o2, occ=None):
@@ -26,50 +34,72 @@ def valid_contraction(o1, o2, occ=None):
         return True
 
 
-def pair_list(lst, occ=None):
+def iter_pairs(lst, occ=None):
+    """
+    Generate the valid full contractions of a list of operators one at a time.
+
+    The contractions are yielded in the same order as pair_list, but only
+    the current branch of the recursion is held in memory.
+    """
     n = len(lst)
     assert n % 2 == 0
     if n < 2:
-        return []
+        return
     elif n == 2:
         if valid_contraction(lst[0], lst[1], occ=occ):
-            return [[(lst[0], lst[1])]]
-        else:
-            return []
+            yield [(lst[0], lst[1])]
     else:
         ltmp = lst[1:]
         yy = lst[0]
-        plist = []
         for i, x in enumerate(ltmp):
-            if valid_contraction(yy, x):
-                p1 = [(lst[0], x)]
-                remainder = pair_list(ltmp[:i] + ltmp[i + 1:])
-                plist += [r + p1 for r in remainder]
-        return plist
+            if valid_contraction(yy, x, occ=occ):
+                p1 = [(yy, x)]
+                remainder = ltmp[:i] + ltmp[i + 1:]
+                for r in iter_pairs(remainder, occ=occ):
+                    yield r + p1
 
 
-def find_pair(i, ipairs):
-    for p in ipairs:
-        if i in p:
-            return p
-    return None
+def pair_list(lst, occ=None):
+    return list(iter_pairs(lst, occ=occ))
 
 
-def get_sign(ipairs):
-    ncross = 0
-    for p in ipairs:
-        i, j = p
-        for x1 in range(i + 1, j):
-            p1 = find_pair(x1, ipairs)
-            if p1 is None:
-                continue
-            x2 = p1[0] if p1[1] == x1 else p1[1]
-            if x2 > j or x2 < i:
-                ncross += 1
+def _count_inversions(seq):
+    # merge sort that returns the sorted list and the number of inversions
+    n = len(seq)
+    if n < 2:
+        return list(seq), 0
+    left, nl = _count_inversions(seq[:n // 2])
+    right, nr = _count_inversions(seq[n // 2:])
+    merged = []
+    ninv = nl + nr
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if right[j] < left[i]:
+            merged.append(right[j])
+            ninv += len(left) - i
+            j += 1
+        else:
+            merged.append(left[i])
+            i += 1
+    merged += left[i:]
+    merged += right[j:]
+    return merged, ninv
+
 
-    assert ncross % 2 == 0
-    ncross = ncross // 2
-    return 1 if ncross % 2 == 0 else -1
+def _parity(seq):
+    _, ninv = _count_inversions(seq)
+    return 1 if ninv % 2 == 0 else -1
+
+
+def get_sign(ipairs):
+    """
+    Return the sign of a full fermionic contraction given as (i, j)
+    position pairs with i < j.
+    """
+    seq = []
+    for i, j in sorted(ipairs):
+        seq += [i, j]
+    return _parity(seq)
 
 
 def split_operators(ops):
@@ -88,85 +118,1174 @@ def split_operators(ops):
     return olists
 
 
-def apply_wick(e, occ=None):
-    to = []
-    # loop over terms
-    for temp in e.terms:
-        olists = split_operators(temp.operators)
-        if not any(olists):
-            to.append(temp.copy())
-            continue
+def vacuum_possible(operators, occ=None):
+    """
+    Check whether a list of operators (without projectors) can have any
+    fully contracted term.
 
-        dos = []
-        sos = []
-        # if member of the product has an odd number of operators,
-        # then we are done
-        oparity = [len(operators) % 2 == 0 for operators in olists]
-        if not all(oparity):
-            continue
-        for operators in olists:
-            if len(operators) == 0:
-                continue
-            # loop to find a contraction
-            plist = pair_list(operators)
-            ds = []
-            ss = []
-            for pairs in plist:
-                good = bool(pairs)
-                ipairs = []
-                deltas = []
-                for p in pairs:
-                    oi, oj = p
-                    if oi.idx.space != oj.idx.space:
-                        good = False
-                        break
-                    if not oi.idx.fermion:
-                        i1 = oi.idx
-                        i2 = oj.idx
-                        deltas.append(Delta(i1, i2))
-                    elif (is_occupied(oi.idx, occ=occ) and oi.ca and not oj.ca) or (
-                            not is_occupied(oi.idx, occ=occ) and not oi.ca and oj.ca):
-                        i = operators.index(oi)
-                        j = operators.index(oj)
-                        ipairs.append((i, j))
-                        i1 = oi.idx
-                        i2 = oj.idx
-                        deltas.append(Delta(i1, i2))
-                    else:
-                        good = False
+    Every contraction pairs a quasi-particle annihilator with a
+    quasi-particle creator of the same space and species to its right, so
+    reading left to right the number of unpaired annihilators must never
+    become negative and must end at zero for each (space, fermion) pair.
+    """
+    nopen = {}
+    for op in operators:
+        key = (op.idx.space, op.idx.fermion)
+        n = nopen.get(key, 0)
+        if op.qp_creation(occ=occ):
+            if n == 0:
+                return False
+            nopen[key] = n - 1
+        else:
+            nopen[key] = n + 1
+    return not any(nopen.values())
+
+
+def operator_signature(operators, occ=None):
+    """
+    Return the signature of a list of operators: a tuple of
+    (space, fermion, qp_creation) for each operator. Operator strings that
+    only differ in their index labels have the same signature and the
+    same contraction pattern.
+    """
+    return tuple(
+        (op.idx.space, op.idx.fermion, op.qp_creation(occ=occ))
+        for op in operators)
+
+
+def _pair_positions(sig, positions):
+    # Generate the full contractions of the operators at the given
+    # positions in pair_list order. The first open operator is always a
+    # quasi-particle annihilator and it is contracted with each later
+    # creator of its partition in turn. Reading on from it, a creator
+    # can be chosen as long as the open annihilators of the partition
+    # outnumber its creators, so once each partition passes the counting
+    # check below every branch ends in a full contraction. The sign
+    # counts the open Fermion operators between the contracted ones.
+    nopen = {}
+    for i in positions:
+        key = sig[i][:2]
+        n = nopen.get(key, 0) + (-1 if sig[i][2] else 1)
+        if n < 0:
+            return
+        nopen[key] = n
+    if any(nopen.values()):
+        return
+
+    def close(rest, pairs, sign):
+        if not rest:
+            yield pairs[::-1], sign
+            return
+        i = rest[0]
+        key = sig[i][:2]
+        r = 1
+        nf = 0
+        for k in range(1, len(rest)):
+            j = rest[k]
+            x = sig[j]
+            if x[:2] == key:
+                if x[2]:
+                    s = -1 if x[1] and nf % 2 == 1 else 1
+                    yield from close(
+                        rest[1:k] + rest[k + 1:], pairs + [(i, j)], s*sign)
+                    r -= 1
+                    if r == 0:
                         break
+                else:
+                    r += 1
+            if x[1]:
+                nf += 1
+
+    yield from close(list(positions), [], 1)
+
+
+def _order_key(pairs):
+    return tuple(j for i, j in sorted(pairs))
+
+
+def contraction_sign(operators, pairs):
+    """
+    Return the sign of a full contraction given as a list of (i, j)
+    position pairs: the parity of the permutation that brings every
+    contracted pair of fermion operators next to each other.
+
+    The contraction templates carry their own signs, so this is not
+    used by apply_wick. It is kept as the reference the template signs
+    are checked against.
+    """
+    seq = []
+    for i, j in sorted(pairs):
+        if operators[i].idx.fermion:
+            seq += [i, j]
+    return _parity(seq)
+
+
+def iter_templates(sig, gens=()):
+    """
+    Generate the full contractions of an operator signature one at a time
+    as (pairs, sign) where pairs is a tuple of (i, j) operator positions.
+
+    The contractions come in the same order as pair_list and only the
+    current branch of the enumeration is held in memory. If gens is
+    given, only one pairing per orbit is generated (see
+    symmetric_templates).
+    """
+    pairings = (
+        (tuple(pairs), sign)
+        for pairs, sign in _pair_positions(sig, range(len(sig))))
+    if gens:
+        pairings = _reduce_orbits(pairings, gens)
+    return pairings
+
+
+def contraction_templates(sig):
+    """
+    Return the full contractions of an operator signature as a list of
+    (pairs, sign) in the same order as pair_list (see iter_templates).
+    """
+    return list(iter_templates(sig))
+
+
+def _reduce_orbits(pairings, gens):
+    # Keep the first pairing of each orbit under the operator permutations
+    # in gens, weighted by the size of the orbit
+    for pairs, sign in pairings:
+        key = _order_key(pairs)
+        start = frozenset(pairs)
+        orbit = {start}
+        stack = [start]
+        first = True
+        while stack and first:
+            p = stack.pop()
+            for g in gens:
+                q = frozenset((g[i], g[j]) for i, j in p)
+                if q in orbit:
+                    continue
+                if _order_key(q) < key:
+                    first = False
+                    break
+                orbit.add(q)
+                stack.append(q)
+        if first:
+            yield pairs, sign*len(orbit)
+
+
+def symmetric_templates(sig, gens):
+    """
+    Return the contraction templates of a signature with one
+    representative per orbit of equivalent pairings.
+
+    gens is a tuple of operator permutations (tuples of positions) that
+    leave the term invariant. Pairings related by these permutations give
+    the same term, so only the first one in pair_list order is kept and
+    its sign is multiplied by the size of the orbit.
+    """
+    return list(iter_templates(sig, gens))
+
+
+class ContractionCache(object):
+    """
+    Least-recently-used cache of contraction templates keyed by operator
+    signature. Both the number of signatures and the total number of
+    templates are bounded, lists longer than maxtemplates are not stored.
+    The cache can be shared between threads. A copy sent to another
+    process keeps its limits but starts empty.
+
+    Attributes:
+        maxsize (int): Maximum number of cached signatures
+        maxtemplates (int): Maximum total number of cached templates
+        hits (int): Number of lookups served from the cache
+        misses (int): Number of lookups that computed the templates
+    """
+    def __init__(self, maxsize=1024, maxtemplates=65536):
+        self.maxsize = maxsize
+        self.maxtemplates = maxtemplates
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._ntemplates = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __reduce__(self):
+        return (ContractionCache, (self.maxsize, self.maxtemplates))
+
+    def get(self, sig, gens=()):
+        """
+        Return the contraction templates of a signature, reduced by the
+        symmetry generators gens if there are any
+        """
+        key = (sig, gens) if gens else sig
+        with self._lock:
+            templates = self._data.get(key)
+            if templates is not None:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return templates
+            self.misses += 1
+
+        # the templates are computed outside of the lock
+        if gens:
+            templates = symmetric_templates(sig, gens)
+        else:
+            templates = contraction_templates(sig)
+        if self.maxsize > 0 and len(templates) <= self.maxtemplates:
+            with self._lock:
+                if key not in self._data:
+                    self._data[key] = templates
+                    self._ntemplates += len(templates)
+                while len(self._data) > self.maxsize \
+                        or self._ntemplates > self.maxtemplates:
+                    _, old = self._data.popitem(last=False)
+                    self._ntemplates -= len(old)
+        return templates
+
+    def clear(self):
+        """Remove all templates and reset the counters"""
+        with self._lock:
+            self._data.clear()
+            self._ntemplates = 0
+            self.hits = 0
+            self.misses = 0
+
+
+contraction_cache = ContractionCache()
+
+# signatures with more pairings than this are streamed and never stored
+max_stored_pairings = 1024
+
+
+def contractions(operators, occ=None, cache=None, gens=()):
+    """
+    Generate the (deltas, sign) pair of each full contraction of a list
+    of operators that contains no projectors.
+
+    The templates of signatures with up to max_stored_pairings pairings
+    are taken from the cache, larger ones are enumerated one at a time.
+
+    cache (ContractionCache): Template cache, the module-level
+        contraction_cache is used by default
+    gens (tuple): Operator permutations that leave the term invariant,
+        see symmetric_templates
+    """
+    if cache is None:
+        cache = contraction_cache
+    sig = operator_signature(operators, occ=occ)
+    if _npairings(sig) > max_stored_pairings:
+        templates = iter_templates(sig, gens)
+    else:
+        templates = cache.get(sig, gens)
+    for pairs, sign in templates:
+        deltas = [
+            Delta(operators[i].idx, operators[j].idx) for i, j in pairs]
+        yield deltas, sign
+
+
+def _block_product(clists):
+    for ci in product(*clists):
+        sign = 1
+        deltas = []
+        for d, s in ci:
+            sign *= s
+            deltas += d
+        yield deltas, sign
+
+
+def _npairings(sig):
+    # Reading left to right, each quasi-particle creator can be contracted
+    # with any of the open annihilators of its partition
+    nopen = {}
+    n = 1
+    for x in sig:
+        key = x[:2]
+        k = nopen.get(key, 0)
+        if x[2]:
+            if k == 0:
+                return 0
+            n *= k
+            nopen[key] = k - 1
+        else:
+            nopen[key] = k + 1
+    return 0 if any(nopen.values()) else n
+
+
+def count_contractions(operators, occ=None):
+    """
+    Return the number of full contractions of a list of operators
+    (possibly containing projectors) without enumerating them.
+    """
+    n = 1
+    for ops in split_operators(operators):
+        n *= _npairings(operator_signature(ops, occ=occ))
+    return n
+
+
+def _term_cost(term, occ=None):
+    return 1 + count_contractions(term.operators, occ=occ)*len(term.operators)
+
+
+_sizes = {}
+
+
+def _sizeof(x):
+    if hasattr(x, "__dict__"):
+        return sys.getsizeof(x) + sys.getsizeof(x.__dict__)
+    return sys.getsizeof(x)
+
+
+def _object_bytes():
+    # memory footprint of the objects making up a term
+    if not _sizes:
+        idx = Idx(0, "occ")
+        for name, x in [
+                ("idx", idx), ("sigma", Sigma(idx)),
+                ("delta", Delta(idx, idx)), ("tensor", Tensor([], "")),
+                ("term", Term(1, [], [], [], []))]:
+            _sizes[name] = _sizeof(x)
+        _sizes["list"] = sys.getsizeof([])
+        _sizes["item"] = sys.getsizeof([None]) - _sizes["list"]
+    return _sizes
+
+
+def _term_bytes(nsums, nindices, ntensors, ndeltas, noperators):
+    b = _object_bytes()
+    nitems = nsums + nindices + ntensors + ndeltas + noperators
+    return b["term"] + (4 + ntensors)*b["list"] + nitems*b["item"]\
+        + nsums*(b["sigma"] + b["idx"]) + ntensors*b["tensor"]\
+        + nindices*b["idx"] + ndeltas*(b["delta"] + 2*b["idx"])
+
+
+def _contracted_bytes(nsums, ntensors, ndeltas):
+    # contracted terms share their indices, sums and tensors with the
+    # operator term, only the term, its lists and the deltas are new
+    b = _object_bytes()
+    return b["term"] + 4*b["list"] + ndeltas*b["delta"]\
+        + (nsums + ntensors + ndeltas)*b["item"]
+
+
+class WickEstimate(object):
+    """
+    Predicted size of a Wick derivation. The pairing counts do not take
+    the symmetry or connectivity reductions of apply_wick into account,
+    so they are an upper bound on the number of output terms.
+
+    Attributes:
+        nterms (int): Number of operator terms
+        pairings (list): Number of full contractions of each term
+        memory (int): Estimated peak memory in bytes of the operator terms
+            and of the fully contracted terms
+    """
+    def __init__(self, nterms, pairings, memory):
+        self.nterms = nterms
+        self.pairings = pairings
+        self.memory = memory
+
+    @property
+    def ncontractions(self):
+        """Total number of fully contracted terms"""
+        return sum(self.pairings)
+
+    def __repr__(self):
+        return "WickEstimate(nterms={}, ncontractions={}, memory={})".format(
+            self.nterms, self.ncontractions, self.memory)
+
+
+def _term_shape(t):
+    return (len(t.sums), sum(len(x.indices) for x in t.tensors),
+            len(t.tensors), len(t.deltas))
+
+
+def estimate_wick(e, occ=None):
+    """
+    Predict the number of contractions apply_wick will enumerate for
+    each term of an expression and the memory of the result.
+
+    e (Expression): Expression of operator strings
+    occ (list): Names of the occupied spaces
+    """
+    bidx = _object_bytes()["idx"]
+    pairings = []
+    memory = 0
+    for t in e.terms:
+        n = count_contractions(t.operators, occ=occ)
+        ns, ni, nt, nd = _term_shape(t)
+        nops = len(t.operators)
+        pairings.append(n)
+        memory += _term_bytes(ns, ni, nt, nd, nops) + nops*bidx
+        memory += n*_contracted_bytes(ns, nt, nd + nops//2)
+    return WickEstimate(len(e.terms), pairings, memory)
+
+
+def estimate_product(A, B, occ=None, vacuum=False):
+    """
+    Predict the size of A*B (or A.multiply(B, vacuum=True)) and of the
+    application of Wick's theorem to it without forming the product.
+
+    A (Expression): Left factor
+    B (Expression): Right factor
+    occ (list): Names of the occupied spaces
+    vacuum (bool): Estimate the rank-pruned product
+    """
+    def info(t):
+        # projectors are marked by None in the signature
+        sig = tuple(
+            None if op.idx is None else
+            (op.idx.space, op.idx.fermion, op.qp_creation(occ=occ))
+            for op in t.operators)
+        return sig, _term_shape(t), t.excitation_rank(occ=occ)
+
+    ainfo = [info(t) for t in A.terms]
+    binfo = [info(t) for t in B.terms]
+    bidx = _object_bytes()["idx"]
+    pairings = []
+    memory = 0
+    for sa, sha, ra in ainfo:
+        for sb, shb, rb in binfo:
+            if vacuum and ra is not None and rb is not None:
+                if dict(ra) != {k: -n for k, n in rb}:
+                    continue
+            # count the contractions block by block across projectors
+            n = 1
+            block = []
+            for x in sa + sb:
+                if x is None:
+                    n *= _npairings(block)
+                    block = []
+                else:
+                    block.append(x)
+            n *= _npairings(block)
+            ns, ni, nt, nd = [x + y for x, y in zip(sha, shb)]
+            nops = len(sa) + len(sb)
+            pairings.append(n)
+            memory += _term_bytes(ns, ni, nt, nd, nops) + nops*bidx
+            memory += n*_contracted_bytes(ns, nt, nd + nops//2)
+    return WickEstimate(len(pairings), pairings, memory)
+
+
+def _operator_permutation(operators, relabel):
+    # Return the permutation of operator positions induced by a relabeling
+    # of indices and its fermion parity, or None if the relabeled
+    # operators are not a reordering of the original ones
+    pos = {(op.idx, op.ca): k for k, op in enumerate(operators)}
+    perm = []
+    for k, op in enumerate(operators):
+        if op.idx in relabel:
+            k = pos.get((relabel[op.idx], op.ca))
+            if k is None:
+                return None
+        perm.append(k)
+    if len(set(perm)) != len(perm):
+        return None
+    fperm = [k for k in perm if operators[k].idx.fermion]
+    return tuple(perm), _parity(fperm)
+
+
+def _preserves_order(sig, perm):
+    # contractions must stay between a quasi-particle annihilator on the
+    # left and a creator on the right
+    n = len(sig)
+    for k in range(n):
+        for l in range(k + 1, n):
+            if sig[k][:2] == sig[l][:2] and sig[k][2] != sig[l][2]:
+                if perm[k] > perm[l]:
+                    return False
+    return True
 
-                # append to output
-                if good:
-                    ds.append(deltas)
-                    ss.append(get_sign(ipairs))
 
-            dos.append(ds)
-            sos.append(ss)
+def _free_indices(temp, operators):
+    # Summed indices that appear once in one tensor and once in the
+    # operators. Relabeling them among themselves leaves the term
+    # unchanged up to the tensor symmetry.
+    summed = {s.idx for s in temp.sums}
+    count = {}
+    for t in temp.tensors:
+        for idx in t.indices:
+            count[idx] = count.get(idx, 0) + 1
+    for d in temp.deltas:
+        count[d.i1] = count.get(d.i1, 0) + 2
+        count[d.i2] = count.get(d.i2, 0) + 2
+    nop = {}
+    for op in operators:
+        nop[op.idx] = nop.get(op.idx, 0) + 1
+    return {
+        idx for idx in summed if count.get(idx) == 1 and nop.get(idx) == 1}
 
-        # If there are no contractions, continue
-        if not sos:
-            assert len(dos) == 0
+
+def _symmetry_generators(temp, operators, sig):
+    # Collect operator permutations that come from relabelings of summed
+    # indices leaving the term invariant up to the sign of the tensor
+    # permutation and the fermion parity of the operator permutation.
+    free = _free_indices(temp, operators).__contains__
+
+    relabels = []
+    # permutational symmetry of a tensor
+    for t in temp.tensors:
+        for perm, sign in t.sym.tlist:
+            moved = [k for k, p in enumerate(perm) if k != p]
+            if not moved:
+                continue
+            if not all(free(t.indices[k]) for k in moved):
+                continue
+            if any(t.indices[k].space != t.indices[perm[k]].space
+                   for k in moved):
+                continue
+            relabels.append(
+                ({t.indices[k]: t.indices[perm[k]] for k in moved}, sign))
+
+    # exchange of two equivalent tensors
+    for n, t1 in enumerate(temp.tensors):
+        for t2 in temp.tensors[n + 1:]:
+            if t1.name != t2.name or len(t1.indices) != len(t2.indices):
+                continue
+            if not t1.indices:
+                continue
+            if any(i1.space != i2.space
+                   for i1, i2 in zip(t1.indices, t2.indices)):
+                continue
+            if not all(free(i) for i in t1.indices + t2.indices):
+                continue
+            relabel = dict(zip(t1.indices, t2.indices))
+            relabel.update(zip(t2.indices, t1.indices))
+            relabels.append((relabel, 1))
+
+    # identical boson operators
+    for k, o1 in enumerate(operators):
+        if o1.idx.fermion:
             continue
-        for di, si in zip(product(*dos), product(*sos)):
-            assert si
-            assert di
-            sign = 1
-            for s in si:
-                sign *= s
-            deltas = []
-            for d in di:
-                deltas += d
-            t1 = Term(
-                sign*temp.scalar,
-                [s.copy() for s in temp.sums],
-                [t.copy() for t in temp.tensors],
-                [], deltas + [d.copy() for d in temp.deltas],
-                index_key=temp.index_key)
-            to.append(t1)
+        for l in range(k + 1, len(operators)):
+            if operators[l] == o1:
+                perm = list(range(len(operators)))
+                perm[k], perm[l] = l, k
+                relabels.append((tuple(perm), 1))
+
+    gens = set()
+    for relabel, sign in relabels:
+        if isinstance(relabel, tuple):
+            perm, parity = relabel, 1
+        else:
+            x = _operator_permutation(operators, relabel)
+            if x is None:
+                continue
+            perm, parity = x
+        if sign*parity == 1 and _preserves_order(sig, perm):
+            gens.add(perm)
+    return tuple(sorted(gens))
+
+
+def _find(parent, g):
+    while parent[g] != g:
+        g = parent[g]
+    return g
+
+
+def _tensor_groups(temp, operators):
+    # Return the named tensor (group) of each operator and the initial
+    # union-find forest of the groups, or None if the term cannot be
+    # pruned safely. Tensors are only connected through summed indices.
+    summed = {s.idx for s in temp.sums}
+    rtensors = [t for t in temp.tensors if t.name and t.indices]
+    if len(rtensors) < 2:
+        return None
+    parent = list(range(len(rtensors)))
+
+    def union(g1, g2):
+        r1 = _find(parent, g1)
+        r2 = _find(parent, g2)
+        if r1 != r2:
+            parent[r2] = r1
+
+    owner = {}
+    for n, t in enumerate(rtensors):
+        for idx in t.indices:
+            if idx not in summed:
+                continue
+            if idx in owner:
+                union(owner[idx], n)
+            else:
+                owner[idx] = n
+
+    # existing deltas may join any tensor that carries one of their indices
+    for d in temp.deltas:
+        ts = [n for n, t in enumerate(rtensors)
+              if d.i1 in t.indices or d.i2 in t.indices]
+        for n in ts[1:]:
+            union(ts[0], n)
+
+    groups = []
+    seen = set()
+    for op in operators:
+        if op.idx in seen:
+            return None
+        seen.add(op.idx)
+        if op.idx in summed:
+            if op.idx not in owner:
+                return None
+            groups.append(owner[op.idx])
+        else:
+            groups.append(None)
+    return groups, parent
+
+
+def connected_pairs(sig, groups, parent):
+    """
+    Generate the (pairs, sign) of the full contractions of an operator
+    signature that leave all operator groups connected.
+
+    Each operator belongs to a group (or None) and parent is the initial
+    union-find forest of the groups. A branch is pruned as soon as a
+    component has no uncontracted operators left without containing
+    every group. The contractions come in the same order as pair_list.
+    """
+    ngroups = len(parent)
+    pending = [0]*ngroups
+    size = [0]*ngroups
+    for g in range(ngroups):
+        size[_find(parent, g)] += 1
+    for g in groups:
+        if g is not None:
+            pending[_find(parent, g)] += 1
+    for g in range(ngroups):
+        if parent[g] == g and pending[g] == 0 and size[g] < ngroups:
+            return
+
+    def closed(pend, sz, r):
+        return pend[r] == 0 and sz[r] < ngroups
+
+    def rec(rest, par, pen, sz):
+        if not rest:
+            yield [], 1
+            return
+        i = rest[0]
+        xi = sig[i]
+        if xi[2]:
+            return
+        gi = groups[i]
+        nf = 0
+        for k in range(1, len(rest)):
+            j = rest[k]
+            xj = sig[j]
+            if xj[2] and xj[:2] == xi[:2]:
+                gj = groups[j]
+                npar, npen, nsz = par, pen, sz
+                ok = True
+                if gi is not None or gj is not None:
+                    npar = list(par)
+                    npen = list(pen)
+                    nsz = list(sz)
+                    roots = []
+                    for g in (gi, gj):
+                        if g is not None:
+                            r = _find(npar, g)
+                            npen[r] -= 1
+                            roots.append(r)
+                    if len(roots) == 2 and roots[0] != roots[1]:
+                        r1, r2 = roots
+                        npar[r2] = r1
+                        npen[r1] += npen[r2]
+                        nsz[r1] += nsz[r2]
+                    ok = not any(
+                        closed(npen, nsz, _find(npar, r)) for r in roots)
+                if ok:
+                    s = -1 if xi[1] and nf % 2 == 1 else 1
+                    remainder = rest[1:k] + rest[k + 1:]
+                    for r, sr in rec(remainder, npar, npen, nsz):
+                        yield r + [(i, j)], s*sr
+            if xj[1]:
+                nf += 1
+
+    yield from rec(list(range(len(sig))), list(parent), pending, size)
+
+
+def _connected_contractions(operators, groups, parent, occ=None, gens=()):
+    sig = operator_signature(operators, occ=occ)
+    pairings = connected_pairs(sig, groups, parent)
+    if gens:
+        pairings = _reduce_orbits(pairings, gens)
+    for pairs, sign in pairings:
+        deltas = [
+            Delta(operators[i].idx, operators[j].idx) for i, j in pairs]
+        yield deltas, sign
+
+
+def _vertex_classes(temp, operators, sig):
+    # Class of each operator: the operators of one tensor with the same
+    # signature entry whose tensor slots can be exchanged with the sign
+    # of the operator exchange. Exchanging them gives the same term, so
+    # a contraction only depends on how many lines join each pair of
+    # classes. Every other operator is a class of its own.
+    free = _free_indices(temp, operators)
+    owner = {}
+    for n, t in enumerate(temp.tensors):
+        for k, idx in enumerate(t.indices):
+            owner[idx] = (n, k)
+
+    members = {}
+    for k, op in enumerate(operators):
+        idx = op.idx
+        if idx in free:
+            key = (owner[idx][0], sig[k])
+        else:
+            key = k
+        members.setdefault(key, []).append(k)
+
+    classes = [None]*len(operators)
+    for key, ks in members.items():
+        if len(ks) > 1:
+            t = temp.tensors[key[0]]
+            slots = [owner[operators[k].idx][1] for k in ks]
+            sign = -1 if key[1][1] else 1
+            tlist = {(tuple(p), x) for p, x in t.sym.tlist}
+            for a, b in zip(slots, slots[1:]):
+                perm = list(range(len(t.indices)))
+                perm[a], perm[b] = b, a
+                if (tuple(perm), sign) not in tlist:
+                    break
+            else:
+                for k in ks:
+                    classes[k] = ks[0]
+                continue
+        for k in ks:
+            classes[k] = k
+    return classes
+
+
+def _line_counts(rows, cols, allowed):
+    # non-negative integer matrices with the given row and column sums
+    # that are zero outside the allowed cells, as dicts of the non-zero
+    # cells
+    cells = [(u, v) for u in rows for v in cols if (u, v) in allowed]
+    rrest = dict(rows)
+    crest = dict(cols)
+
+    def fill(n, m):
+        if n == len(cells):
+            if not any(rrest.values()) and not any(crest.values()):
+                yield dict(m)
+            return
+        u, v = cells[n]
+        for x in range(min(rrest[u], crest[v]), -1, -1):
+            rrest[u] -= x
+            crest[v] -= x
+            if x:
+                m[(u, v)] = x
+            yield from fill(n + 1, m)
+            m.pop((u, v), None)
+            rrest[u] += x
+            crest[v] += x
+
+    yield from fill(0, {})
+
+
+def diagram_templates(sig, classes):
+    """
+    Return one (pairs, weight) per distinct diagram of an operator
+    signature, or None if the classes are not separated.
+
+    classes gives the class of each operator. Operators of the same
+    class are interchangeable: pairings that only differ by a
+    permutation within classes are the same diagram. A diagram is given
+    by the number of lines joining each annihilator class to each
+    creator class. Its representative is its first pairing in pair_list
+    order and its weight is its sign times the number of pairings it
+    stands for. The diagrams are returned in the order of their
+    representatives.
+
+    Every annihilator class must lie entirely to the left or to the
+    right of each creator class of its partition, otherwise None is
+    returned.
+    """
+    pos = {}
+    for k, c in enumerate(classes):
+        pos.setdefault(c, []).append(k)
+    parts = {}
+    for c, ks in pos.items():
+        x = sig[ks[0]]
+        part = parts.setdefault(x[:2], ({}, {}))
+        part[1 if x[2] else 0][c] = len(ks)
+
+    counts = []
+    for ann, cre in parts.values():
+        allowed = set()
+        for u in ann:
+            for v in cre:
+                if pos[u][-1] < pos[v][0]:
+                    allowed.add((u, v))
+                elif pos[u][0] < pos[v][-1]:
+                    return None
+        counts.append(list(_line_counts(ann, cre, allowed)))
+
+    nfact = 1
+    for ks in pos.values():
+        nfact *= factorial(len(ks))
+    out = []
+    for ms in product(*counts):
+        m = {}
+        for x in ms:
+            m.update(x)
+        weight = nfact
+        for x in m.values():
+            weight //= factorial(x)
+
+        # the first pairing: each annihilator from the left takes the
+        # first free creator of a class it still has lines to
+        left = dict(m)
+        free = sorted(k for k, x in enumerate(sig) if x[2])
+        pairs = []
+        for i in range(len(sig)):
+            if sig[i][2]:
+                continue
+            u = classes[i]
+            for n, j in enumerate(free):
+                if left.get((u, classes[j]), 0):
+                    left[(u, classes[j])] -= 1
+                    pairs.append((i, j))
+                    del free[n]
+                    break
+        fseq = [x for i, j in pairs if sig[i][1] for x in (i, j)]
+        out.append((tuple(pairs[::-1]), _parity(fseq)*weight))
+    out.sort(key=lambda x: _order_key(x[0]))
+    return out
+
+
+def _diagram_contractions(temp, operators, sig, gp=None):
+    # contractions of a term with one per diagram, or None. Diagrams
+    # that are mapped onto each other by the symmetries of the term
+    # (e.g. the exchange of two equal tensors) contribute the same and
+    # are merged into the first one.
+    classes = _vertex_classes(temp, operators, sig)
+    templates = diagram_templates(sig, classes)
+    if templates is None:
+        return None
+
+    def key(pairs):
+        lines = {}
+        for i, j in pairs:
+            x = (classes[i], classes[j])
+            lines[x] = lines.get(x, 0) + 1
+        return frozenset(lines.items())
+
+    gens = _symmetry_generators(temp, operators, sig)
+    if gens:
+        index = {key(pairs): n for n, (pairs, _) in enumerate(templates)}
+        done = set()
+        reduced = []
+        for n, (pairs, weight) in enumerate(templates):
+            if n in done:
+                continue
+            done.add(n)
+            norbit = 1
+            stack = [pairs]
+            while stack:
+                p = stack.pop()
+                for g in gens:
+                    q = [(g[i], g[j]) for i, j in p]
+                    m = index[key(q)]
+                    if m not in done:
+                        done.add(m)
+                        norbit += 1
+                        stack.append(templates[m][0])
+            reduced.append((pairs, weight*norbit))
+        templates = reduced
+
+    out = []
+    for pairs, weight in templates:
+        if gp is not None:
+            groups, parent = gp
+            parent = list(parent)
+            for i, j in pairs:
+                gi, gj = groups[i], groups[j]
+                if gi is not None and gj is not None:
+                    r1, r2 = _find(parent, gi), _find(parent, gj)
+                    if r1 != r2:
+                        parent[r2] = r1
+            if len({_find(parent, g) for g in range(len(parent))}) > 1:
+                continue
+        deltas = [
+            Delta(operators[i].idx, operators[j].idx) for i, j in pairs]
+        out.append((deltas, weight))
+    return out
+
+
+def _operator_key(operators):
+    return tuple(
+        (type(op), op.idx, op.ca) if op.idx is not None else (type(op),)
+        for op in operators)
+
+
+def _wick_terms(temp, occ=None, cache=None, connected=False, memo=None,
+                diagrams=False):
+    # generate the fully contracted terms of a term one at a time
+    olists = split_operators(temp.operators)
+    if not any(olists):
+        yield temp.copy()
+        return
+
+    # if member of the product has an odd number of operators,
+    # then we are done
+    oparity = [len(operators) % 2 == 0 for operators in olists]
+    if not all(oparity):
+        return
+    olists = [operators for operators in olists if operators]
+
+    # skip terms where some block cannot be fully contracted
+    if not all(vacuum_possible(ops, occ=occ) for ops in olists):
+        return
+
+    # only terms without projectors are pruned for connectivity
+    gp = None
+    if connected and len(olists) == 1:
+        gp = _tensor_groups(temp, olists[0])
+
+    # a single block can be contracted one diagram at a time
+    clist = None
+    if len(olists) == 1:
+        sig = operator_signature(olists[0], occ=occ)
+        if diagrams:
+            clist = _diagram_contractions(temp, olists[0], sig, gp=gp)
+
+    # otherwise equivalent pairings of a single block are only
+    # enumerated once and its contractions are streamed, terms with the
+    # same operators (and symmetry and connectivity constraints) share
+    # their list of contractions unless it is too long to store
+    if len(olists) == 1 and clist is None:
+        gens = _symmetry_generators(temp, olists[0], sig)
+        key = None
+        if memo is not None and _npairings(sig) <= max_stored_pairings:
+            key = (_operator_key(temp.operators), gens,
+                   None if gp is None else (tuple(gp[0]), tuple(gp[1])))
+            clist = memo.get(key)
+        if clist is None:
+            if gp is not None:
+                clist = _connected_contractions(
+                    olists[0], gp[0], gp[1], occ=occ, gens=gens)
+            else:
+                clist = contractions(
+                    olists[0], occ=occ, cache=cache, gens=gens)
+            if key is not None:
+                clist = memo[key] = list(clist)
+    elif len(olists) > 1:
+        # contract each block once and stream the product over blocks,
+        # stopping at the first block without contractions
+        blocks = []
+        for ops in olists:
+            key = _operator_key(ops)
+            bl = None if memo is None else memo.get(key)
+            if bl is None:
+                bl = list(contractions(ops, occ=occ, cache=cache))
+                if memo is not None:
+                    memo[key] = bl
+            if not bl:
+                return
+            blocks.append(bl)
+        clist = _block_product(blocks)
+
+    # the sums and tensors are shared by the terms of each contraction
+    sums = [s.copy() for s in temp.sums]
+    tensors = [t.copy() for t in temp.tensors]
+    for deltas, sign in clist:
+        yield Term(
+            sign*temp.scalar, list(sums), list(tensors),
+            [], deltas + [d.copy() for d in temp.deltas],
+            index_key=temp.index_key)
+
+
+def _wick_chunk(terms, occ=None, cache=None, connected=False):
+    to = []
+    memo = {}
+    for temp in terms:
+        to.extend(_wick_terms(
+            temp, occ=occ, cache=cache, connected=connected, memo=memo))
+    return to
+
+
+def _chunks(terms, nchunk, occ=None):
+    # split the terms into contiguous chunks of similar estimated cost
+    costs = [_term_cost(t, occ=occ) for t in terms]
+    target = sum(costs)/nchunk
+    chunks = []
+    current = []
+    w = 0
+    for t, c in zip(terms, costs):
+        current.append(t)
+        w += c
+        if w >= target:
+            chunks.append(current)
+            current = []
+            w = 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def apply_wick(e, occ=None, cache=None,
+               nproc=None, executor=None, connected=False):
+    """
+    Apply Wick's theorem to every term of an expression and return the
+    expression of fully contracted terms.
+
+    e (Expression): Expression of operator strings, or a LazyExpression
+        which is expanded one term at a time
+    occ (list): Names of the occupied spaces
+    cache (ContractionCache): Template cache
+    nproc (int): Number of worker processes
+    executor (Executor): concurrent.futures executor to use instead of a
+        new process pool, threads share the cache while worker processes
+        fill their own copy
+    connected (bool): Skip contractions that can only give disconnected
+        terms (see ATerm.connected)
+    """
+    # drop terms whose excitation rank cannot reach the vacuum
+    if isinstance(e, LazyExpression):
+        terms = e.iter_terms(occ=occ, vacuum=True)
+    else:
+        terms = [
+            t for t in e.terms if t.excitation_rank(occ=occ) in (None, ())]
+
+    if executor is None and (nproc is None or nproc < 2):
+        to = []
+        memo = {}
+        # loop over terms
+        for temp in terms:
+            to.extend(_wick_terms(
+                temp, occ=occ, cache=cache, connected=connected, memo=memo))
+    else:
+        if nproc is None:
+            nproc = os.cpu_count() or 1
+        pool = executor
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=nproc)
+        try:
+            # several chunks per worker keep the load balanced, the
+            # results come back in the order of the chunks
+            chunks = _chunks(list(terms), 4*nproc, occ=occ)
+            to = []
+            for tc in pool.map(
+                    _wick_chunk, chunks, repeat(occ), repeat(cache),
+                    repeat(connected)):
+                to += tc
+        finally:
+            if executor is None:
+                pool.shutdown()
 
     o = Expression(to)
     if o.are_operators():
         raise Exception("Application of Wick's theorem has failed!")
 
     return o
+
+
+def _derive(terms, occ=None, cache=None, connected=False, memo=None,
+            diagrams=False):
+    final = AExpression()
+    collector = _TermCollector()
+    for temp in terms:
+        if temp.excitation_rank(occ=occ) not in (None, ()):
+            continue
+        for t in _wick_terms(
+                temp, occ=occ, cache=cache, connected=connected, memo=memo,
+                diagrams=diagrams):
+            if t.operators:
+                raise Exception("Application of Wick's theorem has failed!")
+            t.resolve()
+            if abs(t.scalar) > final.tthresh:
+                collector.add(ATerm(term=t))
+
+    final.terms = [
+        t for t in collector.collect() if abs(t.scalar) > final.tthresh]
+    final.sort()
+    return final
+
+
+def derive(e, occ=None, cache=None, connected=False, diagrams=False):
+    """
+    Apply Wick's theorem to an expression and return the simplified
+    AExpression of the fully contracted terms.
+
+    The result is the same as resolving the output of apply_wick and
+    building an AExpression from it, but each contracted term is
+    resolved and merged into the simplified terms as soon as it is
+    generated, so only the distinct terms are kept in memory.
+
+    e (Expression): Expression of operator strings, or a LazyExpression
+        which is expanded one term at a time
+    occ (list): Names of the occupied spaces
+    cache (ContractionCache): Template cache
+    connected (bool): Skip contractions that can only give disconnected
+        terms (see ATerm.connected)
+    diagrams (bool): Contract each operator string one diagram at a
+        time (see diagram_templates) instead of one pairing at a time.
+        The antisymmetrized vertices of a term are read off its
+        tensors, and strings whose vertices are not separated are
+        contracted pairing by pairing.
+    """
+    if isinstance(e, LazyExpression):
+        terms = e.iter_terms(occ=occ, vacuum=True)
+    else:
+        terms = e.terms
+    return _derive(
+        terms, occ=occ, cache=cache, connected=connected, memo={},
+        diagrams=diagrams)
+
+
+def project(e, projections, occ=None, cache=None, connected=False,
+            diagrams=False):
+    """
+    Contract an operator expression between a list of projections and
+    return one simplified AExpression per projection.
+
+    The result for a (bra, ket) pair is the same as derive(bra*e*ket).
+    The excitation rank of each term of e is computed once, and only the
+    bra, e and ket terms whose ranks add up to zero are multiplied. The
+    contraction lists of repeated operator strings are shared between
+    the projections.
+
+    e (Expression): Expression of operator strings (e.g. Hbar). A
+        LazyExpression is expanded once to the terms whose rank can be
+        projected out.
+    projections (list): List of (bra, ket) pairs of Expressions, either
+        of which can be None
+    occ (list): Names of the occupied spaces
+    cache (ContractionCache): Template cache
+    connected (bool): Skip contractions that can only give disconnected
+        terms (see ATerm.connected)
+    diagrams (bool): Contract one diagram at a time (see derive)
+    """
+    unit = [Term(1, [], [], [], [])]
+    if isinstance(e, LazyExpression):
+        targets = set()
+        for bra, ket in projections:
+            bterms = unit if bra is None else bra.terms
+            kterms = unit if ket is None else ket.terms
+            for b, k in product(bterms, kterms):
+                targets.add(_add_ranks(
+                    b.excitation_rank(occ=occ), k.excitation_rank(occ=occ)))
+        if None in targets:
+            e = e.expand(occ=occ)
+        else:
+            targets = frozenset(_neg_rank(r) for r in targets)
+            e = Expression([t for t, r in e._iter(targets, occ)])
+    ranks = [t.excitation_rank(occ=occ) for t in e.terms]
+    memo = {}
+    out = []
+    for bra, ket in projections:
+        bterms = unit if bra is None else bra.terms
+        kterms = unit if ket is None else ket.terms
+        kranks = [t.excitation_rank(occ=occ) for t in kterms]
+        terms = []
+        for b in bterms:
+            rb = b.excitation_rank(occ=occ)
+            for t, rt in zip(e.terms, ranks):
+                rbt = _add_ranks(rb, rt)
+                bt = None
+                for k, rk in zip(kterms, kranks):
+                    if _add_ranks(rbt, rk) not in (None, ()):
+                        continue
+                    if bt is None:
+                        bt = t if bra is None else b*t
+                    terms.append(bt if ket is None else bt*k)
+        out.append(_derive(
+            terms, occ=occ, cache=cache, connected=connected, memo=memo,
+            diagrams=diagrams))
+    return out